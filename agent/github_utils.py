@@ -24,8 +24,8 @@ def get_current_memory_manager():
     session_id = flask_session.get("session_id")
     if session_id and session_id in sessions:
         return sessions[session_id]["memory_manager"]
-    from memory import MemoryManager
-    return MemoryManager()  # Fallback to default
+    from memory import get_shared_memory_manager
+    return get_shared_memory_manager()  # Fallback to default
 
 
 def get_current_github_rag():
@@ -1,16 +1,27 @@
 import os
 import subprocess
 import argparse
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
-import anthropic
-from anthropic import RateLimitError, APIError
 import sqlite3
 import json
-from IPython.core.interactiveshell import InteractiveShell
-from IPython.utils.capture import capture_output
 import io
 import contextlib
+import asyncio
+import re
+import ast
+import threading
+import select
+import signal
+import time
+import uuid
+import functools
+import tempfile
+import shutil
+import atexit
+import email.utils
+from datetime import datetime
+import concurrent.futures
+import hashlib
 
 from memory import MemoryManager
 
@@ -22,14 +33,25 @@ def main():
     parser.add_argument('--initial-user-input', type=str, default=None, required=False,
                       help='Initial user input (default: None)')
     parser.add_argument('--auto-confirm', action='store_true', help='Automatically confirm all actions without prompting')
+    parser.add_argument('--stream', action=argparse.BooleanOptionalAction, default=True,
+                      help='Stream assistant responses as they are generated (default: on)')
     parser.add_argument('--exit-on-user-input', action='store_true', help='Exit immediately after receiving user input (not initial_user_input)')
+    parser.add_argument('--cache', action='store_true', help='Reuse responses for identical requests from a local SQLite cache')
+    parser.add_argument('--batch-inputs-file', type=str, default=None, required=False,
+                      help='JSONL file of user prompts to run together through the Message Batches API (half price, results within 24h)')
     args = parser.parse_args()
     
+    if args.batch_inputs_file:
+        llm = LLM("claude-3-7-sonnet-latest", args.prompt_file)
+        batch_loop(llm, args.batch_inputs_file, args.auto_confirm)
+        return
+
     try:
         print("\n=== LLM Agent Loop with Claude and Bash Tool ===\n")
         print("Type 'exit' to end the conversation.\n")
         loop(
-            LLM("claude-3-7-sonnet-latest", args.prompt_file),
+            LLM("claude-3-7-sonnet-latest", args.prompt_file, stream=args.stream,
+                cache=ResponseCache() if args.cache else None),
             args.initial_user_input,
             args.auto_confirm if hasattr(args, 'auto_confirm') else False,
             args.exit_on_user_input if hasattr(args, 'exit_on_user_input') else False
@@ -40,47 +62,110 @@ def main():
         print(f"\n\nAn error occurred: {str(e)}")
 
 def loop(llm, initial_user_input=None, auto_confirm=False, exit_on_user_input=False):
-    memory_manager = MemoryManager()
+    asyncio.run(agent_loop(llm, initial_user_input, auto_confirm, exit_on_user_input))
+
+async def agent_loop(llm, initial_user_input=None, auto_confirm=False, exit_on_user_input=False):
+    """The conversation loop, run on a single event loop for the whole session."""
+    memory_manager = get_memory_manager()
     
     if initial_user_input:
-        # Load relevant memories for initial input
-        relevant_memories = memory_manager.get_memory_context(initial_user_input, max_memories=3)
-        if relevant_memories != "No relevant memories found.":
-            context_msg = f"{relevant_memories}\n\n=== USER MESSAGE ===\n{initial_user_input}"
-            msg = [{"type": "text", "text": context_msg}]
-        else:
-            msg = [{"type": "text", "text": initial_user_input}]
+        msg = build_user_message(initial_user_input, memory_manager)
     else:
-        user_msg = user_input()
+        user_msg = await user_input()
         if exit_on_user_input:
             print("\nExiting after user input as requested by --exit-on-user-input flag.")
             raise SystemExit(0)
-        
-        # Load relevant memories for user input
-        user_text = user_msg[0]["text"]
-        relevant_memories = memory_manager.get_memory_context(user_text, max_memories=3)
-        if relevant_memories != "No relevant memories found.":
-            context_msg = f"{relevant_memories}\n\n=== USER MESSAGE ===\n{user_text}"
-            msg = [{"type": "text", "text": context_msg}]
-        else:
-            msg = user_msg
+        msg = build_user_message(user_msg[0]["text"], memory_manager)
             
     while True:
-        output, tool_calls = llm(msg)
-        print("Agent: ", output)
+        # The SDK client is synchronous; keep it off the event loop thread
+        output, tool_calls = await asyncio.to_thread(llm, msg)
+        if not llm.stream:
+            print("Agent: ", output)
         if tool_calls:
-            msg = [ handle_tool_call(tc, auto_confirm) for tc in tool_calls ]
+            msg = await dispatch_tool_calls(tool_calls, auto_confirm)
         else:
-            user_msg = user_input()
-            # Load relevant memories for new user input
-            user_text = user_msg[0]["text"]
-            relevant_memories = memory_manager.get_memory_context(user_text, max_memories=3)
-            if relevant_memories != "No relevant memories found.":
-                context_msg = f"{relevant_memories}\n\n=== USER MESSAGE ===\n{user_text}"
-                msg = [{"type": "text", "text": context_msg}]
-            else:
-                msg = user_msg
+            user_msg = await user_input()
+            msg = build_user_message(user_msg[0]["text"], memory_manager)
+
+def build_user_message(user_text, memory_manager):
+    """Build the user turn, prefixed with relevant memories when there are any. Does one memory lookup."""
+    relevant_memories = memory_manager.get_memory_context(user_text, max_memories=3)
+    if relevant_memories != "No relevant memories found.":
+        return [{"type": "text", "text": f"{relevant_memories}\n\n=== USER MESSAGE ===\n{user_text}"}]
+    return [{"type": "text", "text": user_text}]
+
+def read_batch_inputs(path):
+    """Read prompts from a JSONL file; each line is a JSON string or an object with a "prompt" (and optional "custom_id")."""
+    inputs = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                entry = {"prompt": entry}
+            entry.setdefault("custom_id", f"input-{len(inputs)}")
+            inputs.append(entry)
+    return inputs
+
+def batch_loop(llm, batch_inputs_file, auto_confirm=False, max_rounds=20):
+    """Run every prompt in batch_inputs_file through the Message Batches API.
+
+    Each round submits all unfinished conversations as one batch, runs the returned tool calls,
+    and sends their results in the next round, until no conversation asks for more tools.
+    """
+    inputs = read_batch_inputs(batch_inputs_file)
+    if not inputs:
+        print(f"No prompts found in {batch_inputs_file}")
+        return
+    conversations = {
+        entry["custom_id"]: [{"role": "user", "content": [{"type": "text", "text": entry["prompt"]}]}]
+        for entry in inputs
+    }
+    pending = list(conversations)
 
+    for round_number in range(1, max_rounds + 1):
+        batch = llm.create_batch({custom_id: conversations[custom_id] for custom_id in pending})
+        print(f"Submitted batch {batch.id} (round {round_number}) with {len(pending)} requests")
+        llm.wait_for_batch(batch.id)
+
+        tool_calls_by_id = {}
+        for result in llm.client.messages.batches.results(batch.id):
+            print(f"\n=== {result.custom_id} ===")
+            if result.result.type != "succeeded":
+                print(f"Request {result.result.type}: {getattr(result.result, 'error', '')}")
+                continue
+            assistant_content = []
+            tool_calls = []
+            for content in result.result.message.content:
+                if content.type == "text":
+                    print("Agent: ", content.text)
+                    assistant_content.append({"type": "text", "text": content.text})
+                elif content.type == "tool_use":
+                    assistant_content.append({"type": "tool_use", "id": content.id, "name": content.name, "input": content.input})
+                    tool_calls.append({"id": content.id, "name": content.name, "input": content.input})
+            conversations[result.custom_id].append({"role": "assistant", "content": assistant_content})
+            if tool_calls:
+                tool_calls_by_id[result.custom_id] = tool_calls
+
+        if not tool_calls_by_id:
+            return
+
+        async def run_all():
+            # One lock across every request so confirmations from different prompts don't interleave
+            confirm_lock = asyncio.Lock()
+            return await asyncio.gather(*[
+                asyncio.gather(*[handle_tool_call(tc, auto_confirm, confirm_lock) for tc in tool_calls])
+                for tool_calls in tool_calls_by_id.values()
+            ])
+
+        for custom_id, tool_results in zip(tool_calls_by_id, asyncio.run(run_all())):
+            conversations[custom_id].append({"role": "user", "content": [_truncate_tool_result(r) for r in tool_results]})
+        pending = list(tool_calls_by_id)
+
+    print(f"\nStopped after {max_rounds} rounds; {len(pending)} conversations still had tool calls pending.")
 
 bash_tool = {
     "name": "bash",
@@ -145,7 +230,6 @@ ipython_tool = {
 }
 
 # --- Edit File tool definitions ---
-# Requires: pip install patch
 edit_file_diff_tool = {
     "name": "edit_file_diff",
     "description": "Edit a file by applying a unified diff patch. The input should include the file path and the diff string in unified diff format.",
@@ -184,77 +268,441 @@ overwrite_file_tool = {
     }
 }
 
-def execute_bash(command):
+# --- Memory tool definitions ---
+save_memory_tool = {
+    "name": "save_memory",
+    "description": "Save information to memory for future reference.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "A descriptive title for the memory"},
+            "content": {"type": "string", "description": "The content to store in memory"},
+            "tags": {"type": "array", "items": {"type": "string"}, "description": "Optional tags to categorize the memory"}
+        },
+        "required": ["title", "content"]
+    }
+}
+
+search_memory_tool = {
+    "name": "search_memory",
+    "description": "Search stored memories by content, title, or tags.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Search query to find relevant memories"},
+            "tags": {"type": "array", "items": {"type": "string"}, "description": "Optional tags to filter memories"},
+            "limit": {"type": "integer", "description": "Maximum number of memories to return (default: 10)"}
+        }
+    }
+}
+
+list_memories_tool = {
+    "name": "list_memories",
+    "description": "List all stored memories with optional pagination.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "limit": {"type": "integer", "description": "Maximum number of memories to return (default: 20)"},
+            "offset": {"type": "integer", "description": "Number of memories to skip (default: 0)"}
+        }
+    }
+}
+
+get_memory_tool = {
+    "name": "get_memory",
+    "description": "Retrieve a specific memory by its ID.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "memory_id": {"type": "string", "description": "The ID of the memory to retrieve"}
+        },
+        "required": ["memory_id"]
+    }
+}
+
+delete_memory_tool = {
+    "name": "delete_memory",
+    "description": "Delete a memory by its ID.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "memory_id": {"type": "string", "description": "The ID of the memory to delete"}
+        },
+        "required": ["memory_id"]
+    }
+}
+
+# The schema list never changes, so every LLM shares it; the last entry carries the prompt-cache breakpoint
+TOOLS = (
+    bash_tool, sqlite_tool, ipython_tool, edit_file_diff_tool, overwrite_file_tool,
+    save_memory_tool, search_memory_tool, list_memories_tool, get_memory_tool,
+    {**delete_memory_tool, "cache_control": {"type": "ephemeral"}},
+)
+
+# Per-stream cap on captured bash output; a command that exceeds it is killed
+_BASH_OUTPUT_CAP = 256 * 1024
+_TRUNCATED_NOTE = "\n[...truncated...]"
+
+# The `exec` builtin would replace the persistent shell, so such commands get a fresh one. Only exec in
+# command position counts: `find ... -exec` is an ordinary argument.
+_BASH_ONESHOT_RE = re.compile(r'(?:^|[;&|(){}]|\b(?:then|do|else)\b)\s*exec\b', re.MULTILINE)
+
+class BashCoprocess:
+    """A long-lived bash process that commands are piped into, so each call skips fork/exec and shell startup."""
+
+    def __init__(self):
+        self.proc = None
+        self.lock = threading.Lock()
+        self.work_dir = None
+        # Shell code recreating the exported environment and cwd as of the last finished command
+        self.state = ""
+
+    def _ensure_started(self):
+        if self.work_dir is None:
+            self.work_dir = tempfile.mkdtemp(prefix="bash-agent-")
+            atexit.register(shutil.rmtree, self.work_dir, True)
+        if self.proc is None or self.proc.poll() is not None:
+            self.proc = subprocess.Popen(
+                ["bash"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                bufsize=0,
+                start_new_session=True
+            )
+
+    def restart(self):
+        """Kill the shell and anything it started; the next run() starts a fresh one."""
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            self.proc.wait()
+        self.proc = None
+        self.state = ""
+
+    def run(self, command, timeout=30):
+        """Run a command and return (stdout, stderr, exit_code). Raises TimeoutError after restarting the shell."""
+        self._ensure_started()
+        marker = f"__END_{uuid.uuid4().hex}__"
+        # The command is sourced from its own file, so an unbalanced quote or brace is a parse error with
+        # a status instead of swallowing the sentinel lines; stdin is /dev/null so it can't read them either
+        script_path = os.path.join(self.work_dir, "command.sh")
+        with open(script_path, "w") as f:
+            f.write(command + "\n")
+        state_path = os.path.join(self.work_dir, "state.sh")
+        script = (
+            f". '{script_path}' < /dev/null\n"
+            "__bash_agent_status=$?\n"
+            f"{{ export -p; printf 'cd -- %q || exit\\n' \"$PWD\"; }} > '{state_path}'\n"
+            f"printf '{marker}%s{marker}' \"$__bash_agent_status\"\n"
+            f"printf '{marker}' >&2\n"
+        )
+        self.proc.stdin.write(script.encode())
+        end_re = re.compile(re.escape(marker.encode()) + rb'(\d+)' + re.escape(marker.encode()))
+        err_marker = marker.encode()
+        stdout_fd = self.proc.stdout.fileno()
+        out, err = bytearray(), bytearray()
+        pending = {stdout_fd: out, self.proc.stderr.fileno(): err}
+        exit_code = None
+        truncated = False
+        deadline = time.monotonic() + timeout
+        while pending and not truncated:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.restart()
+                raise TimeoutError(f"Command '{command}' timed out after {timeout} seconds")
+            ready, _, _ = select.select(list(pending), [], [], remaining)
+            for fd in ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    # The shell exited (`exit`, a syntax error, ...)
+                    del pending[fd]
+                    continue
+                buf = pending[fd]
+                buf += chunk
+                if fd == stdout_fd:
+                    match = end_re.search(buf)
+                    if match:
+                        exit_code = int(match.group(1))
+                        del buf[match.start():]
+                        del pending[fd]
+                elif buf.endswith(err_marker):
+                    del buf[-len(err_marker):]
+                    del pending[fd]
+                if fd in pending and len(buf) > _BASH_OUTPUT_CAP:
+                    del buf[_BASH_OUTPUT_CAP:]
+                    truncated = True
+                    break
+        if truncated:
+            self.restart()
+            stdout, stderr = out.decode(errors='replace'), err.decode(errors='replace')
+            if len(out) >= _BASH_OUTPUT_CAP:
+                stdout += _TRUNCATED_NOTE
+            if len(err) >= _BASH_OUTPUT_CAP:
+                stderr += _TRUNCATED_NOTE
+            return stdout, stderr, -signal.SIGKILL
+        if exit_code is None:
+            exit_code = self.proc.wait()
+            self.proc = None
+            self.state = ""
+        else:
+            with open(state_path) as f:
+                self.state = f.read()
+        return out.decode(errors='replace'), err.decode(errors='replace'), exit_code
+
+_bash = BashCoprocess()
+
+def _kill_group(proc):
+    """Kill a one-shot bash and its children, which would otherwise keep the output pipes open."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+async def _read_capped(stream, buf, proc):
+    """Read a subprocess stream into buf, killing proc once buf passes _BASH_OUTPUT_CAP. Returns True if truncated."""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            return False
+        buf += chunk
+        if len(buf) > _BASH_OUTPUT_CAP:
+            del buf[_BASH_OUTPUT_CAP:]
+            _kill_group(proc)
+            return True
+
+async def execute_bash(command):
     """Execute a bash command and return a formatted string with the results."""
     # If we have a timeout exception, we'll return an error message instead
     try:
-        result = subprocess.run(
-            ["bash", "-c", command],
-            capture_output=True,
-            text=True,
-            timeout=30
+        # Use the persistent shell unless the command needs a fresh one or another
+        # concurrent tool call is already using it
+        if not _BASH_ONESHOT_RE.search(command) and _bash.lock.acquire(blocking=False):
+            try:
+                stdout, stderr, returncode = await asyncio.to_thread(_bash.run, command, 30)
+            finally:
+                _bash.lock.release()
+            return f"STDOUT:\n{stdout}\nSTDERR:\n{stderr}\nEXIT CODE: {returncode}"
+        # Start from the persistent shell's exported environment and cwd, so a command that can't use the
+        # shell itself still runs where the previous commands left off
+        proc = await asyncio.create_subprocess_exec(
+            "bash", "-c", f"{_bash.state}\n{command}",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
         )
-        return f"STDOUT:\n{result.stdout}\nSTDERR:\n{result.stderr}\nEXIT CODE: {result.returncode}"
+        out, err = bytearray(), bytearray()
+        try:
+            out_truncated, err_truncated = await asyncio.wait_for(
+                asyncio.gather(_read_capped(proc.stdout, out, proc), _read_capped(proc.stderr, err, proc)),
+                timeout=30
+            )
+            await proc.wait()
+        except asyncio.TimeoutError:
+            _kill_group(proc)
+            await proc.wait()
+            return f"Error executing command: Command '{command}' timed out after 30 seconds"
+        stdout = out.decode(errors='replace') + (_TRUNCATED_NOTE if out_truncated else "")
+        stderr = err.decode(errors='replace') + (_TRUNCATED_NOTE if err_truncated else "")
+        return f"STDOUT:\n{stdout}\nSTDERR:\n{stderr}\nEXIT CODE: {proc.returncode}"
     except Exception as e:
         return f"Error executing command: {str(e)}"
 
+_SQLITE_FETCH_SIZE = 1000
+# Rows beyond this are summarized rather than sent back to the model; use output_json for full results
+_MAX_PRINT_ROWS = 50
+# Row-returning statements; matched without lowercasing a copy of the whole query
+_SELECT_RE = re.compile(r'^\s*(?:with\b|select\b)', re.I)
+
+def _write_json_records(batches, columns, output_json):
+    """Write row batches to output_json as a JSON array of objects, one record at a time.
+
+    The output matches json.dump(records, f, indent=2). Returns (record_count, first_record).
+    """
+    count = 0
+    first_record = None
+    with open(output_json, 'w') as f:
+        f.write('[')
+        for batch in batches:
+            for row in batch:
+                # sqlite3.Row maps itself in C; plain tuples need their column names zipped in
+                record = dict(row) if isinstance(row, sqlite3.Row) else dict(zip(columns, row))
+                if first_record is None:
+                    first_record = record
+                f.write(',\n  ' if count else '\n  ')
+                # Newlines only appear structurally in JSON output, so this nests the record one level
+                f.write(json.dumps(record, indent=2).replace('\n', '\n  '))
+                count += 1
+        f.write('\n]' if count else ']')
+    return count, first_record
+
+def _format_rows(rows, total):
+    """Format the first _MAX_PRINT_ROWS of `total` rows for the context window, noting how many were left out."""
+    lines = [f"{i}: {row}" for i, row in enumerate(rows[:_MAX_PRINT_ROWS])]
+    if total > _MAX_PRINT_ROWS:
+        lines.append(f"... and {total - _MAX_PRINT_ROWS} more")
+    return "\n".join(lines)
+
+# db_path -> (connection, lock, file identity); connections are reused across tool calls
+_SQLITE_CONNS = {}
+_SQLITE_CONNS_LOCK = threading.Lock()
+
+def _file_identity(db_path):
+    try:
+        st = os.stat(db_path)
+        return st.st_dev, st.st_ino
+    except OSError:
+        return None
+
+def _sqlite_connection(db_path):
+    """Return a pooled (connection, lock) for db_path, reopening it if the file was replaced or removed."""
+    key = os.path.abspath(db_path) if db_path != ":memory:" else db_path
+    with _SQLITE_CONNS_LOCK:
+        entry = _SQLITE_CONNS.get(key)
+        if entry is not None:
+            if entry[2] == _file_identity(db_path):
+                return entry[0], entry[1]
+            entry[0].close()
+        # Tool calls run in worker threads; the per-connection lock keeps them from interleaving
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        # Only per-connection settings: journal_mode=WAL would persist in the user's file
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        lock = threading.Lock()
+        _SQLITE_CONNS[key] = (conn, lock, _file_identity(db_path))
+        return conn, lock
+
 def execute_sqlite(db_path, query, output_json=None, print_result=False):
     """Execute an SQL query on a SQLite database and return the results or error. Optionally write SELECT results to a JSON file and/or print them."""
     try:
-        conn = sqlite3.connect(db_path)
+        conn, lock = _sqlite_connection(db_path)
+    except Exception as e:
+        return f"Error executing SQL: {str(e)}"
+    with lock:
         cursor = conn.cursor()
-        cursor.execute(query)
-        if query.strip().lower().startswith("select"):
-            rows = cursor.fetchall()
+        cursor.arraysize = _SQLITE_FETCH_SIZE
+        try:
+            cursor.execute(query)
+            if not _SELECT_RE.match(query):
+                conn.commit()
+                return f"Query executed successfully. Rows affected: {cursor.rowcount}"
             columns = [desc[0] for desc in cursor.description] if cursor.description else []
-            result_data = [dict(zip(columns, row)) for row in rows]
+            show_rows = print_result or not output_json
+            # Rows are streamed from the cursor in batches; only the printed preview is kept in memory
+            preview = []
+            total = 0
+
+            def batches():
+                nonlocal total
+                for batch in iter(cursor.fetchmany, []):
+                    if show_rows and len(preview) < _MAX_PRINT_ROWS:
+                        preview.extend(tuple(row) for row in batch[:_MAX_PRINT_ROWS - len(preview)])
+                    total += len(batch)
+                    yield batch
+
             summary = None
             if output_json:
-                with open(output_json, 'w') as f:
-                    json.dump(result_data, f, indent=2)
-                if result_data:
-                    summary = f"Wrote {len(result_data)} records to {output_json}. First record: {result_data[0]}"
+                cursor.row_factory = sqlite3.Row
+                count, first_record = _write_json_records(batches(), columns, output_json)
+                if count:
+                    summary = f"Wrote {count} records to {output_json}. First record: {first_record}"
                 else:
                     summary = f"Wrote 0 records to {output_json}."
-            if print_result or not output_json:
-                result = f"Columns: {columns}\nRows: {rows}"
+            else:
+                for _ in batches():
+                    pass
+            if show_rows:
+                result = f"Columns: {columns}\nRows:\n{_format_rows(preview, total)}"
                 if summary:
                     return summary + "\n" + result
                 else:
                     return result
             else:
                 return summary
-        else:
-            conn.commit()
-            result = f"Query executed successfully. Rows affected: {cursor.rowcount}"
-        cursor.close()
-        conn.close()
-        return result
-    except Exception as e:
-        return f"Error executing SQL: {str(e)}"
+        except Exception as e:
+            # Don't leave a half-finished implicit transaction open on the shared connection
+            if conn.in_transaction:
+                conn.rollback()
+            return f"Error executing SQL: {str(e)}"
+        finally:
+            cursor.close()
+
+# Only cells shorter than this go through the compiled-cell cache
+_CODE_CACHE_MAX_LEN = 4096
+# Magics and shell escapes need IPython's input transformers, so they go through run_cell
+_MAGIC_RE = re.compile(r'^\s*[%!]', re.MULTILINE)
+# Only pay for capture_output when the cell is likely to publish rich display data
+_RICH_DISPLAY_RE = re.compile(r'plt\.|display\(|Image\(')
+_ipython_buffers = threading.local()
+
+def _reset_buffer(name):
+    """Return a per-thread StringIO that has been emptied for reuse."""
+    buf = getattr(_ipython_buffers, name, None)
+    if buf is None:
+        buf = io.StringIO()
+        setattr(_ipython_buffers, name, buf)
+    buf.seek(0)
+    buf.truncate(0)
+    return buf
+
+@functools.lru_cache(maxsize=512)
+def _compile_cell(code):
+    """Compile a cell into an exec body plus an optional trailing expression, mirroring run_cell's last-expression result."""
+    tree = ast.parse(code, '<agent>', 'exec')
+    last_expr = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last_expr = compile(ast.Expression(tree.body.pop().value), '<agent>', 'eval')
+    return compile(tree, '<agent>', 'exec'), last_expr
+
+def _run_cached(shell, code):
+    """Run a short, magic-free cell from the compiled cache. Returns (handled, result_value)."""
+    if len(code) >= _CODE_CACHE_MAX_LEN or _MAGIC_RE.search(code):
+        return False, None
+    try:
+        body, last_expr = _compile_cell(code)
+    except SyntaxError:
+        # Let run_cell produce IPython's usual syntax error report
+        return False, None
+    try:
+        exec(body, shell.user_ns)
+        if last_expr is not None:
+            return True, eval(last_expr, shell.user_ns)
+    except Exception:
+        shell.showtraceback()
+    return True, None
 
 def execute_ipython(code, print_result=False):
     """Execute Python code using IPython and return stdout, stderr, and rich output."""
+    # Imported here so runs that never touch the ipython tool don't pay IPython's import time
+    from IPython.core.interactiveshell import InteractiveShell
+    from IPython.utils.capture import capture_output
     shell = InteractiveShell.instance()
-    output_buffer = io.StringIO()
-    error_buffer = io.StringIO()
+    output_buffer = _reset_buffer('stdout')
+    error_buffer = _reset_buffer('stderr')
     rich_output = ""
+    wants_capture = _RICH_DISPLAY_RE.search(code) is not None
     try:
-        with capture_output() as cap:
-            with contextlib.redirect_stdout(output_buffer):
-                with contextlib.redirect_stderr(error_buffer):
-                    result = shell.run_cell(code, store_history=False)
+        with contextlib.ExitStack() as stack:
+            cap = stack.enter_context(capture_output()) if wants_capture else None
+            stack.enter_context(contextlib.redirect_stdout(output_buffer))
+            stack.enter_context(contextlib.redirect_stderr(error_buffer))
+            handled, value = _run_cached(shell, code)
+            if not handled:
+                value = shell.run_cell(code, store_history=False).result
         # Collect outputs
         stdout = output_buffer.getvalue()
         stderr = error_buffer.getvalue()
         # Rich output (display_data, etc.)
-        if cap.outputs:
+        if cap is not None and cap.outputs:
             for out in cap.outputs:
                 if hasattr(out, 'data') and 'text/plain' in out.data:
                     rich_output += out.data['text/plain'] + "\n"
         # If there's a result value, show it
-        if result.result is not None:
-            rich_output += repr(result.result) + "\n"
+        if value is not None:
+            rich_output += repr(value) + "\n"
         output_text = f"STDOUT:\n{stdout}\nSTDERR:\n{stderr}\nRICH OUTPUT:\n{rich_output}"
         if print_result:
             print(f"IPython output:\n{output_text}")
@@ -262,30 +710,122 @@ def execute_ipython(code, print_result=False):
     except Exception as e:
         return f"Error executing Python code: {str(e)}"
 
-def apply_unified_diff(file_path, diff):
-    """Apply a unified diff to a file using the python-patch library. Returns a result string."""
-    import tempfile
-    import patch
-    import os
+_HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+def parse_unified_diff(diff):
+    """Parse a unified diff into a list of hunks, each (source_start, [(tag, line), ...]).
+
+    File headers are skipped; all hunks are taken to apply to the same file.
+    """
+    hunks = []
+    lines = diff.splitlines(keepends=True)
+    i = 0
+    while i < len(lines):
+        match = _HUNK_HEADER_RE.match(lines[i])
+        i += 1
+        if not match:
+            continue
+        source_left = int(match.group(2)) if match.group(2) is not None else 1
+        target_left = int(match.group(4)) if match.group(4) is not None else 1
+        body = []
+        while i < len(lines) and (source_left > 0 or target_left > 0 or lines[i].startswith('\\')):
+            line = lines[i]
+            if line.startswith('\\'):
+                # "\ No newline at end of file" applies to the line before it
+                if body:
+                    tag, text = body[-1]
+                    body[-1] = (tag, text.rstrip('\r\n'))
+                i += 1
+                continue
+            if line in ('\n', '\r\n'):
+                # Context line for an empty line whose leading space was stripped
+                tag, text = ' ', line
+            elif line[:1] in (' ', '-', '+'):
+                tag, text = line[:1], line[1:]
+            else:
+                break
+            if tag != '+':
+                source_left -= 1
+            if tag != '-':
+                target_left -= 1
+            body.append((tag, text))
+            i += 1
+        hunks.append((int(match.group(1)), body))
+    return hunks
+
+def _find_hunk(lines, source, expected, lowest):
+    """Find where source matches lines, trying `expected` first and then nearby offsets like patch(1).
+
+    Line numbers in model-written diffs are often off, so the nearest match at or after `lowest` wins.
+    Returns the index, or None if the hunk matches nowhere.
+    """
+    size = len(source)
+    highest = len(lines) - size
+    if not source:
+        return expected if lowest <= expected <= len(lines) else None
+    for offset in range(max(expected - lowest, highest - expected, 0) + 1):
+        for idx in (expected - offset, expected + offset) if offset else (expected,):
+            if lowest <= idx <= highest and lines[idx] == source[0] and lines[idx:idx + size] == source:
+                return idx
+    return None
+
+def apply_hunks(content, hunks):
+    """Apply parsed hunks to content and return the patched text. Raises ValueError when a hunk doesn't match."""
+    lines = content.splitlines(keepends=True)
+    stripped = [l.rstrip('\r\n') for l in lines]
+    out = []
+    pos = 0
+    for number, (start, body) in enumerate(hunks, 1):
+        source = [text for tag, text in body if tag != '+']
+        # A hunk without source lines inserts after line `start`
+        idx = max(start - 1, 0) if source else start
+        idx = _find_hunk(stripped, [l.rstrip('\r\n') for l in source], idx, pos)
+        if idx is None:
+            raise ValueError(f"hunk {number} does not match the file at line {start}")
+        actual = lines[idx:idx + len(source)]
+        out.extend(lines[pos:idx])
+        # Context lines are copied from the file so its line endings are kept
+        file_lines = iter(actual)
+        for tag, text in body:
+            if tag == ' ':
+                out.append(next(file_lines))
+            elif tag == '-':
+                next(file_lines)
+            else:
+                out.append(text)
+        pos = idx + len(source)
+    out.extend(lines[pos:])
+    return ''.join(out)
+
+def render_unified_diff(file_path, diff):
+    """Read file_path once and apply diff in memory. Returns (new_content, error); exactly one is None."""
     try:
-        # Write the diff to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8', suffix='.patch') as tmp_patch:
-            tmp_patch.write(diff)
-            patch_path = tmp_patch.name
-        # Apply the patch
-        pset = patch.fromfile(patch_path)
-        if not pset:
-            os.unlink(patch_path)
-            return f"Failed to parse patch file."
-        result = pset.apply()
-        os.unlink(patch_path)
-        if result:
-            return f"Applied diff to {file_path}."
-        else:
-            return f"Failed to apply diff to {file_path}."
+        hunks = parse_unified_diff(diff)
+        if not hunks:
+            return None, "Failed to parse patch file."
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            return apply_hunks(f.read(), hunks), None
+    except ValueError as e:
+        return None, f"Failed to apply diff to {file_path}: {e}"
+    except Exception as e:
+        return None, f"Error applying diff: {str(e)}"
+
+def write_rendered_diff(file_path, new_content):
+    """Write content produced by render_unified_diff back to file_path. Returns a result string."""
+    try:
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(new_content)
+        return f"Applied diff to {file_path}."
     except Exception as e:
         return f"Error applying diff: {str(e)}"
 
+def apply_unified_diff(file_path, diff):
+    """Apply a unified diff to a file in-process. Returns a result string."""
+    new_content, error = render_unified_diff(file_path, diff)
+    if error:
+        return error
+    return write_rendered_diff(file_path, new_content)
+
 def overwrite_file(file_path, content):
     """Overwrite a file with new content."""
     try:
@@ -295,149 +835,369 @@ def overwrite_file(file_path, content):
     except Exception as e:
         return f"Error overwriting file: {str(e)}"
 
-def user_input():
-    x = input("You: ")
+async def user_input():
+    # Read in a worker thread so the event loop keeps running while the user types
+    x = await asyncio.to_thread(input, "You: ")
     if x.lower() in ["exit", "quit"]:
         print("\nExiting agent loop. Goodbye!")
         raise SystemExit(0)
     return [{"type": "text", "text": x}]
 
+# Once history exceeds _HISTORY_MAX_MESSAGES, everything but the last ~_HISTORY_KEEP_MESSAGES is summarized
+_HISTORY_MAX_MESSAGES = 40
+_HISTORY_KEEP_MESSAGES = 20
+_TOOL_RESULT_MAX_CHARS = 16 * 1024
+
+def _truncate_tool_result(block):
+    """Keep the head and tail of oversized tool_result text so one noisy command can't dominate the context."""
+    if not isinstance(block, dict) or block.get("type") != "tool_result":
+        return block
+    parts = []
+    for part in block.get("content", []):
+        text = part.get("text", "") if isinstance(part, dict) else ""
+        if len(text) > _TOOL_RESULT_MAX_CHARS:
+            half = _TOOL_RESULT_MAX_CHARS // 2
+            elided = len(text) - 2 * half
+            part = {**part, "text": f"{text[:half]}\n[...{elided} characters elided...]\n{text[-half:]}"}
+        parts.append(part)
+    return {**block, "content": parts}
+
+def _message_to_text(message):
+    """Flatten a conversation message (dict or SDK content blocks) into plain text for summarization."""
+    lines = []
+    for block in message["content"]:
+        get = block.get if isinstance(block, dict) else lambda key, default=None: getattr(block, key, default)
+        block_type = get("type")
+        if block_type == "text":
+            lines.append(get("text", ""))
+        elif block_type == "tool_use":
+            lines.append(f"[tool_use {get('name')}: {json.dumps(get('input', {}))}]")
+        elif block_type == "tool_result":
+            result = "".join(part.get("text", "") for part in get("content", []) if isinstance(part, dict))
+            lines.append(f"[tool_result: {result[:2000]}]")
+    return f"{message['role'].upper()}: " + "\n".join(lines)
+
+class ResponseCache:
+    """Exact-match cache of API responses keyed by a hash of the full request, stored in SQLite."""
+
+    def __init__(self, db_path=os.path.expanduser("~/.bash-agent-cache.db"), ttl_seconds=24 * 60 * 60):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response BLOB, ts INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_ts ON cache(ts)")
+            # Expired entries are never served, so drop them rather than let the file grow
+            conn.execute("DELETE FROM cache WHERE ts < ?", (int(time.time()) - self.ttl_seconds,))
+
+    @staticmethod
+    def key(model, system, messages, tools):
+        # Assistant turns hold SDK content blocks, so serialize those through their model dump
+        payload = json.dumps(
+            {"model": model, "sys": system, "msgs": messages, "tools": tools},
+            sort_keys=True,
+            default=lambda o: o.model_dump() if hasattr(o, "model_dump") else str(o)
+        )
+        return hashlib.blake2b(payload.encode()).hexdigest()
+
+    def get(self, key):
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT response FROM cache WHERE key = ? AND ts >= ?",
+                (key, int(time.time()) - self.ttl_seconds)
+            ).fetchone()
+        if not row:
+            return None
+        # Stored as JSON, not pickle: loading never runs code from the file and survives SDK upgrades.
+        # Rows the current SDK can't validate (including pickles from older versions) count as misses.
+        try:
+            return _anthropic().types.Message.model_validate_json(row[0])
+        except ValueError:
+            return None
+
+    def put(self, key, response):
+        with sqlite3.connect(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, response, ts) VALUES (?, ?, ?)",
+                (key, response.model_dump_json(), int(time.time()))
+            )
+
+def _anthropic():
+    """Import the SDK on first use; it dominates startup time for --help and argument errors."""
+    import anthropic
+    return anthropic
+
+@functools.lru_cache(maxsize=1)
+def _shared_client():
+    """One client (and so one keep-alive connection pool) for every LLM in the process."""
+    import httpx
+    anthropic = _anthropic()
+    return anthropic.Anthropic(http_client=anthropic.DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300)
+    ))
+
+def _api_errors():
+    """Exceptions worth retrying or reporting; an except clause evaluates this only when something is raised."""
+    anthropic = _anthropic()
+    return (anthropic.RateLimitError, anthropic.APIError)
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one; later callers wait for the first caller's result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, fn):
+        """Return (result, shared); shared is True when the result came from another caller's call."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+        if not leader:
+            return future.result(), True
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result(), False
+
+# LLM calls run in worker threads (see agent_loop), so coalescing is process-wide and thread-safe
+_single_flight = SingleFlight()
+
+_API_MAX_ATTEMPTS = 5
+_RATELIMIT_KINDS = ("requests", "tokens", "input-tokens", "output-tokens")
+
+def _is_retryable(error):
+    """Connection errors, timeouts, conflicts, rate limits and server errors are worth retrying; other 4xx are not."""
+    status = getattr(error, "status_code", None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+def _retry_delay(error, attempt):
+    """Seconds to wait before the next attempt, from retry-after or the exhausted limit's reset time.
+
+    Falls back to exponential backoff (4s doubling to 60s) when the response carries no hint.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return max(float(retry_after), 1.0)
+        except ValueError:
+            try:
+                return max(email.utils.parsedate_to_datetime(retry_after).timestamp() - time.time(), 1.0)
+            except (TypeError, ValueError):
+                pass
+    resets = []
+    for kind in _RATELIMIT_KINDS:
+        reset = headers.get(f"anthropic-ratelimit-{kind}-reset")
+        if reset and headers.get(f"anthropic-ratelimit-{kind}-remaining") == "0":
+            try:
+                resets.append(datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp())
+            except ValueError:
+                pass
+    if resets:
+        return max(max(resets) - time.time(), 1.0)
+    return min(max(2 ** attempt, 4), 60)
+
+_BASE_SYSTEM_PROMPT = (
+    """You are a helpful AI assistant with access to bash, sqlite, Python, file editing, and memory tools.\n"""
+    "You can help the user by executing commands and interpreting the results.\n"
+    "Be careful with destructive commands and always explain what you're doing.\n\n"
+
+    "AVAILABLE TOOLS:\n"
+    "- bash: Run shell commands\n"
+    "- sqlite: Execute SQL queries on SQLite databases\n"
+    "- ipython: Execute Python code with rich output support\n"
+    "- edit_file_diff: Apply unified diff patches to files\n"
+    "- overwrite_file: Replace entire file contents\n"
+    "- Memory tools: save_memory, search_memory, list_memories, get_memory, delete_memory\n\n"
+
+    "SQLITE USAGE:\n"
+    "For large SELECT queries, you can specify an 'output_json' file path in the sqlite tool input. If you do, write the full result to that file and only print errors or the first record in the response.\n"
+    "You can also set 'print_result' to true to print the results in the context window, even if output_json is specified. This is useful for letting you see and reason about the data in context.\n\n"
+
+    "PYTHON ENVIRONMENT:\n"
+    "When generating plots in Python (e.g., with matplotlib), always save the plot to a file (such as .png) and mention the filename in your response. Do not attempt to display plots inline.\n"
+    "The Python environment for the ipython tool includes: numpy, matplotlib, scikit-learn, ipykernel, torch, tqdm, gymnasium, torchvision, tensorboard, torch-tb-profiler, opencv-python, nbconvert, anthropic, seaborn, pandas, tenacity.\n\n"
+
+    "MEMORY USAGE:\n"
+    "Use the memory tools to store and retrieve important information across conversations:\n"
+    "- save_memory: Store important facts, solutions, configurations, or insights\n"
+    "- search_memory: Find relevant information from previous sessions\n"
+    "- list_memories: Browse all stored memories\n"
+    "- get_memory: Retrieve a specific memory by ID\n"
+    "- delete_memory: Remove outdated or incorrect memories\n"
+    "Always check for relevant memories before starting complex tasks to leverage previous work.\n\n"
+)
+
+@functools.lru_cache(maxsize=8)
+def _load_prompt(path, mtime):
+    """Read a prompt file; keyed on mtime so edits to the file are picked up."""
+    with open(path, 'r') as f:
+        return f.read()
+
 class LLM:
-    def __init__(self, model, prompt_file):
+    def __init__(self, model, prompt_file, stream=False, cache=None):
         if "ANTHROPIC_API_KEY" not in os.environ:
             raise ValueError("ANTHROPIC_API_KEY environment variable not found.")
-        self.client = anthropic.Anthropic()
+        self.client = _shared_client()
         self.model = model
+        self.stream = stream
+        self.cache = cache
         self.messages = []
         if prompt_file:
-            # read prompt file from provided path
-            with open(prompt_file, 'r') as f:
-                prompt = f.read()
+            prompt = _load_prompt(prompt_file, os.path.getmtime(prompt_file))
         else:
             prompt = ""
-        self.system_prompt = (
-            """You are a helpful AI assistant with access to bash, sqlite, Python, file editing, and memory tools.\n"""
-            "You can help the user by executing commands and interpreting the results.\n"
-            "Be careful with destructive commands and always explain what you're doing.\n\n"
-            
-            "AVAILABLE TOOLS:\n"
-            "- bash: Run shell commands\n"
-            "- sqlite: Execute SQL queries on SQLite databases\n"  
-            "- ipython: Execute Python code with rich output support\n"
-            "- edit_file_diff: Apply unified diff patches to files\n"
-            "- overwrite_file: Replace entire file contents\n"
-            "- Memory tools: save_memory, search_memory, list_memories, get_memory, delete_memory\n\n"
-            
-            "SQLITE USAGE:\n"
-            "For large SELECT queries, you can specify an 'output_json' file path in the sqlite tool input. If you do, write the full result to that file and only print errors or the first record in the response.\n"
-            "You can also set 'print_result' to true to print the results in the context window, even if output_json is specified. This is useful for letting you see and reason about the data in context.\n\n"
-            
-            "PYTHON ENVIRONMENT:\n"
-            "When generating plots in Python (e.g., with matplotlib), always save the plot to a file (such as .png) and mention the filename in your response. Do not attempt to display plots inline.\n"
-            "The Python environment for the ipython tool includes: numpy, matplotlib, scikit-learn, ipykernel, torch, tqdm, gymnasium, torchvision, tensorboard, torch-tb-profiler, opencv-python, nbconvert, anthropic, seaborn, pandas, tenacity.\n\n"
-            
-            "MEMORY USAGE:\n"
-            "Use the memory tools to store and retrieve important information across conversations:\n"
-            "- save_memory: Store important facts, solutions, configurations, or insights\n"
-            "- search_memory: Find relevant information from previous sessions\n"
-            "- list_memories: Browse all stored memories\n"
-            "- get_memory: Retrieve a specific memory by ID\n"
-            "- delete_memory: Remove outdated or incorrect memories\n"
-            "Always check for relevant memories before starting complex tasks to leverage previous work.\n\n"
-            + prompt
-        )
-        # Add memory tools
-        save_memory_tool = {
-            "name": "save_memory",
-            "description": "Save information to memory for future reference.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "title": {"type": "string", "description": "A descriptive title for the memory"},
-                    "content": {"type": "string", "description": "The content to store in memory"},
-                    "tags": {"type": "array", "items": {"type": "string"}, "description": "Optional tags to categorize the memory"}
-                },
-                "required": ["title", "content"]
-            }
-        }
-        
-        search_memory_tool = {
-            "name": "search_memory",
-            "description": "Search stored memories by content, title, or tags.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "query": {"type": "string", "description": "Search query to find relevant memories"},
-                    "tags": {"type": "array", "items": {"type": "string"}, "description": "Optional tags to filter memories"},
-                    "limit": {"type": "integer", "description": "Maximum number of memories to return (default: 10)"}
-                }
-            }
-        }
-        
-        list_memories_tool = {
-            "name": "list_memories",
-            "description": "List all stored memories with optional pagination.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "limit": {"type": "integer", "description": "Maximum number of memories to return (default: 20)"},
-                    "offset": {"type": "integer", "description": "Number of memories to skip (default: 0)"}
-                }
-            }
-        }
-        
-        get_memory_tool = {
-            "name": "get_memory",
-            "description": "Retrieve a specific memory by its ID.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "memory_id": {"type": "string", "description": "The ID of the memory to retrieve"}
-                },
-                "required": ["memory_id"]
-            }
-        }
-        
-        delete_memory_tool = {
-            "name": "delete_memory",
-            "description": "Delete a memory by its ID.",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "memory_id": {"type": "string", "description": "The ID of the memory to delete"}
-                },
-                "required": ["memory_id"]
-            }
-        }
-        
-        self.memory_manager = MemoryManager()
-        self.tools = [bash_tool, sqlite_tool, ipython_tool, edit_file_diff_tool, overwrite_file_tool, save_memory_tool, search_memory_tool, list_memories_tool, get_memory_tool, delete_memory_tool]
-
-    @retry(
-        retry=retry_if_exception_type((RateLimitError, APIError)),
-        wait=wait_exponential(multiplier=1, min=4, max=60),
-        stop=stop_after_attempt(5),
-        reraise=True
-    )
+        system_text = _BASE_SYSTEM_PROMPT + prompt
+        # System prompt and tool schemas are identical on every turn, so mark them as cache breakpoints
+        self.system_prompt = [{"type": "text", "text": system_text, "cache_control": {"type": "ephemeral"}}]
+        self.memory_manager = get_memory_manager()
+        self.tools = TOOLS
+
     def _call_anthropic(self):
-        return self.client.messages.create(
+        """Send the request, retrying transient failures after the delay the API asks for."""
+        for attempt in range(1, _API_MAX_ATTEMPTS + 1):
+            try:
+                return self._request()
+            except _api_errors() as e:
+                if attempt == _API_MAX_ATTEMPTS or not _is_retryable(e):
+                    raise
+                delay = _retry_delay(e, attempt)
+                print(f"\n[{type(e).__name__}: retrying in {delay:.1f}s (attempt {attempt + 1}/{_API_MAX_ATTEMPTS})]")
+                time.sleep(delay)
+
+    def _request(self):
+        params = dict(
             model=self.model,
             max_tokens=20_000,
             system=self.system_prompt,
             messages=self.messages,
             tools=self.tools
         )
+        if not self.stream:
+            return self.client.messages.create(**params)
+        # Print text as it is generated; tool_use blocks come from the final message
+        with self.client.messages.stream(**params) as stream:
+            print("Agent: ", end="", flush=True)
+            for text in stream.text_stream:
+                print(text, end="", flush=True)
+            print()
+            return stream.get_final_message()
+
+    def create_batch(self, conversations):
+        """Submit {custom_id: messages} as a single Message Batch with this agent's system prompt and tools."""
+        requests = [
+            {
+                "custom_id": custom_id,
+                "params": {
+                    "model": self.model,
+                    "max_tokens": 20_000,
+                    "system": self.system_prompt,
+                    "tools": self.tools,
+                    "messages": messages
+                }
+            }
+            for custom_id, messages in conversations.items()
+        ]
+        return self.client.messages.batches.create(requests=requests)
+
+    def wait_for_batch(self, batch_id, max_delay=60):
+        """Poll a batch with exponential backoff until it has finished processing."""
+        delay = 4
+        while True:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status == "ended":
+                return batch
+            print(f"[Batch {batch_id}: {batch.processing_status}, checking again in {delay}s]")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def _print_reused(self, response, source):
+        print(f"[Response served from {source}]")
+        if self.stream:
+            # Nothing was streamed for this turn, so show the text the caller would otherwise miss
+            text = "".join(block.text for block in response.content if block.type == "text")
+            print(f"Agent: {text}")
+
+    def _cached_call(self):
+        """Call the API, answering from the response cache when the exact same request was seen before
+        and sharing one call between identical requests that are in flight at the same time."""
+        key = ResponseCache.key(self.model, self.system_prompt, self.messages, self.tools)
+        if self.cache is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                self._print_reused(response, "cache")
+                return response
+        response, shared = _single_flight.do(key, self._call_anthropic)
+        if shared:
+            self._print_reused(response, "a concurrent identical request")
+        elif self.cache is not None:
+            self.cache.put(key, response)
+        return response
+
+    def _compact_history(self):
+        """Replace older turns with a model-written summary once the history grows past the window."""
+        if len(self.messages) <= _HISTORY_MAX_MESSAGES:
+            return
+        # Cut just before an assistant turn so the summary (a user message) keeps roles
+        # alternating and no tool_use is separated from its tool_result
+        cut = len(self.messages) - _HISTORY_KEEP_MESSAGES
+        while cut < len(self.messages) and self.messages[cut]["role"] != "assistant":
+            cut += 1
+        if cut >= len(self.messages):
+            return
+        transcript = "\n\n".join(_message_to_text(m) for m in self.messages[:cut])
+        try:
+            response = self.client.messages.create(
+                model=self.model,
+                max_tokens=1024,
+                system="Summarize the following conversation into key facts and open tasks. Be concise; keep file paths, commands, and decisions.",
+                messages=[{"role": "user", "content": transcript}]
+            )
+        except _api_errors() as e:
+            print(f"\n[History summarization failed, keeping full history: {e}]")
+            return
+        summary = "".join(block.text for block in response.content if block.type == "text")
+        # Keep the evicted turns findable: memory retrieval surfaces the summary on later relevant turns
+        try:
+            get_memory_manager().save_memory(
+                f"Conversation summary ({time.strftime('%Y-%m-%d %H:%M')})",
+                summary,
+                ["conversation_summary"]
+            )
+        except Exception as e:
+            print(f"[Could not save conversation summary to memory: {e}]")
+        self.messages[:cut] = [{
+            "role": "user",
+            "content": [{"type": "text", "text": f"=== SUMMARY OF EARLIER CONVERSATION ===\n{summary}"}]
+        }]
+        print(f"[Summarized {cut} earlier messages to bound conversation history]")
 
     def __call__(self, content):
-        self.messages.append({"role": "user", "content": content})
-        self.messages[-1]["content"][-1]["cache_control"] = {"type": "ephemeral"}
+        content = [_truncate_tool_result(block) for block in content]
+        # The newest user turn is sent with the conversation breakpoint (the API allows four in total)
+        # and stored unmarked once the call returns, so no marker outlives its request
+        self.messages.append({"role": "user", "content": [*content[:-1], {**content[-1], "cache_control": {"type": "ephemeral"}}]})
+        unmarked = {"role": "user", "content": content}
         try:
-            response = self._call_anthropic()
-        except (RateLimitError, APIError) as e:
+            response = self._cached_call()
+        except _api_errors() as e:
+            self.messages[-1] = unmarked
             print(f"\nRate limit or API error occurred: {str(e)}")
             raise
-        finally:
-            del self.messages[-1]["content"][-1]["cache_control"]
+        self.messages[-1] = unmarked
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            cache_read = getattr(usage, "cache_read_input_tokens", 0) or 0
+            cache_write = getattr(usage, "cache_creation_input_tokens", 0) or 0
+            print(f"[Tokens: input={usage.input_tokens}, cache_read={cache_read}, cache_write={cache_write}, output={usage.output_tokens}]")
         assistant_response = {"role": "assistant", "content": []}
         tool_calls = []
         output_text = ""
@@ -456,310 +1216,318 @@ class LLM:
                 })
 
         self.messages.append(assistant_response)
+        self._compact_history()
         return output_text, tool_calls
 
-def handle_tool_call(tool_call, auto_confirm=False):
-    if tool_call["name"] == "bash":
-        command = tool_call["input"]["command"]
-        print(f"\nAbout to execute bash command:\n\n{command}")
-        if not auto_confirm:
-            confirm = input("Enter to confirm or x to cancel").strip().lower()
-        else:
-            print("[Auto-confirm enabled: proceeding without prompt]")
-            confirm = ""
-        if confirm == "x":
-            print("Command execution skipped by user.")
-            output_text = "Command execution was skipped by user confirmation. Seek user input for next steps"
-        else:
-            print(f"Executing bash command: {command}")
-            output_text = execute_bash(command)
-            print(f"Bash output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(
-                type="text",
-                text=output_text
-            )]
-        )
-    elif tool_call["name"] == "sqlite":
-        db_path = tool_call["input"]["db_path"]
-        query = tool_call["input"]["query"]
-        output_json = tool_call["input"].get("output_json")
-        print_result = tool_call["input"].get("print_result", False)
-        print(f"\nAbout to execute SQLite query on {db_path}:\n\n{query}")
-        if output_json:
-            print(f"Full results will be written to: {output_json}")
-        if print_result:
-            print("Results will also be printed in the context window.")
-        if not auto_confirm:
-            confirm = input("Enter to confirm or x to cancel").strip().lower()
-        else:
-            print("[Auto-confirm enabled: proceeding without prompt]")
-            confirm = ""
-        if confirm == "x":
-            print("SQL execution skipped by user.")
-            output_text = "SQL execution was skipped by user confirmation. Seek user input for next steps"
-        else:
-            print(f"Executing SQL query: {query}")
-            output_text = execute_sqlite(db_path, query, output_json, print_result)
-            print(f"SQLite output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(
-                type="text",
-                text=output_text
-            )]
-        )
-    elif tool_call["name"] == "ipython":
-        code = tool_call["input"]["code"]
-        print_result = tool_call["input"].get("print_result", False)
-        print(f"\nAbout to execute Python code with IPython:\n\n{code}")
-        if print_result:
-            print("Result will also be printed in the context window.")
-        if not auto_confirm:
-            confirm = input("Enter to confirm or x to cancel").strip().lower()
-        else:
-            print("[Auto-confirm enabled: proceeding without prompt]")
-            confirm = ""
-        if confirm == "x":
-            print("Python execution skipped by user.")
-            output_text = "Python execution was skipped by user confirmation. Seek user input for next steps"
+async def _confirm():
+    """Ask the user to confirm a tool call without blocking other running tool calls."""
+    answer = await asyncio.to_thread(input, "Enter to confirm or x to cancel")
+    return answer.strip().lower()
+
+def _summarize_tool_call(tool_call):
+    """One-line description of a pending tool call for the batched confirmation prompt."""
+    tool_input = tool_call["input"]
+    detail = next((tool_input[k] for k in ("command", "query", "code", "file_path", "title", "memory_id") if k in tool_input), "")
+    detail = str(detail).strip().replace("\n", " ")
+    if len(detail) > 120:
+        detail = detail[:117] + "..."
+    return f"{tool_call['name']}: {detail}"
+
+def _parse_selection(answer, count):
+    """Map a batched confirmation answer to the set of approved indices: "" = all, "x" = none, "1,3" = those."""
+    if answer == "":
+        return set(range(count))
+    if answer == "x":
+        return set()
+    selected = set()
+    for part in answer.split(","):
+        part = part.strip()
+        if part.isdigit() and 1 <= int(part) <= count:
+            selected.add(int(part) - 1)
+    return selected
+
+# Tools that only read state; anything else may depend on, or change, what an earlier call left behind
+_READ_ONLY_TOOLS = frozenset({"search_memory", "list_memories", "get_memory"})
+_READ_ONLY_SQL_RE = re.compile(r"\s*(select|explain)\b", re.IGNORECASE)
+
+def _is_read_only(tool_call):
+    if tool_call["name"] == "sqlite":
+        inp = tool_call["input"]
+        return not inp.get("output_json") and _READ_ONLY_SQL_RE.match(inp["query"]) is not None
+    return tool_call["name"] in _READ_ONLY_TOOLS
+
+async def _run_in_call_order(tool_calls, run):
+    """Run run(index, tool_call) for each call, returning results in call order.
+
+    Consecutive read-only calls overlap; a call with side effects waits for everything before it
+    and runs alone, so e.g. a file write never races the `mkdir` the model issued ahead of it.
+    """
+    results = []
+    group = []
+
+    async def flush():
+        results.extend(await asyncio.gather(*group))
+        group.clear()
+
+    for index, tool_call in enumerate(tool_calls):
+        if _is_read_only(tool_call):
+            group.append(run(index, tool_call))
         else:
-            print(f"Executing Python code:")
-            output_text = execute_ipython(code, print_result)
+            await flush()
+            results.append(await run(index, tool_call))
+    await flush()
+    return results
+
+async def dispatch_tool_calls(tool_calls, auto_confirm=False):
+    """Run the tool calls from one assistant turn in call order, overlapping only read-only ones."""
+    # Previews and prompts are serialized so they don't interleave on the terminal
+    confirm_lock = asyncio.Lock()
+    if auto_confirm or len(tool_calls) == 1:
+        return await _run_in_call_order(tool_calls, lambda _, tc: handle_tool_call(tc, auto_confirm, confirm_lock))
+
+    # Several calls: confirm them all with one prompt instead of one prompt per call
+    print("\nThe agent wants to run these tool calls:")
+    for i, tool_call in enumerate(tool_calls, 1):
+        print(f"\n  {i}. {_summarize_tool_call(tool_call)}")
+        # Show the full command, diff or file content being approved, not just the one-line summary.
+        # Approved calls re-render at run time, since an earlier call in the batch may change the file.
+        preview = _TOOL_HANDLERS.get(tool_call["name"], (None,))[0]
+        if preview is not None:
+            preview(tool_call["input"])
+    print()
+    answer = await asyncio.to_thread(input, "Enter to confirm all, x to cancel all, or numbers to run (e.g. 1,3): ")
+    approved = _parse_selection(answer.strip().lower(), len(tool_calls))
+
+    async def run(index, tool_call):
+        if index in approved:
+            return await handle_tool_call(tool_call, True, confirm_lock)
+        print(f"Skipped {tool_call['name']} call {index + 1} by user.")
         return dict(
             type="tool_result",
             tool_use_id=tool_call["id"],
             content=[dict(
                 type="text",
-                text=output_text
+                text="Tool call was skipped by user confirmation. Seek user input for next steps"
             )]
         )
-    elif tool_call["name"] == "edit_file_diff":
-        file_path = tool_call["input"]["file_path"]
-        diff = tool_call["input"]["diff"]
-        print(f"\nAbout to apply unified diff to {file_path}:")
-        print(diff)
-        # Preview the result of applying the diff
-        import tempfile
-        import shutil
-        import patch
-        preview_success = False
-        try:
-            with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8', suffix='.patch') as tmp_patch:
-                tmp_patch.write(diff)
-                patch_path = tmp_patch.name
-            with tempfile.NamedTemporaryFile(delete=False, mode='w', encoding='utf-8') as tmp_file:
-                preview_path = tmp_file.name
-            shutil.copyfile(file_path, preview_path)
-            pset = patch.fromfile(patch_path)
-            if pset:
-                # Patch expects the file to be in the current directory, so chdir
-                cwd = os.getcwd()
-                try:
-                    os.chdir(os.path.dirname(preview_path) or ".")
-                    # Patch the temp file (patch library works on filenames)
-                    # We need to adjust the filenames in the patch object to match the temp file
-                    for patched_file in pset.items:
-                        patched_file.target = os.path.basename(preview_path)
-                        patched_file.source = os.path.basename(preview_path)
-                    result = pset.apply()
-                finally:
-                    os.chdir(cwd)
-                if result:
-                    with open(preview_path, 'r', encoding='utf-8') as f:
-                        preview_content = f.read()
-                    print("\n--- Preview of file after applying diff ---\n")
-                    print(preview_content)
-                    preview_success = True
-                else:
-                    print("\n[Preview failed: could not apply diff to temp file]")
-            else:
-                print("\n[Preview failed: could not parse diff]")
-        except Exception as e:
-            print(f"[Preview error: {e}]")
-        finally:
-            try:
-                os.unlink(patch_path)
-            except Exception:
-                pass
-            try:
-                os.unlink(preview_path)
-            except Exception:
-                pass
-        if not auto_confirm:
-            confirm = input("Enter to confirm or x to cancel").strip().lower()
+
+    return await _run_in_call_order(tool_calls, run)
+
+def _tool_result(tool_use_id, text):
+    return dict(
+        type="tool_result",
+        tool_use_id=tool_use_id,
+        content=[dict(
+            type="text",
+            text=text
+        )]
+    )
+
+# --- Confirmed tools: preview(input, show) prints what will happen (unless show is False) and returns any state run() needs ---
+
+def _preview_bash(inp, show=True):
+    if not show:
+        return
+    print(f"\nAbout to execute bash command:\n\n{inp['command']}")
+
+async def _run_bash(inp, _):
+    print(f"Executing bash command: {inp['command']}")
+    output_text = await execute_bash(inp["command"])
+    print(f"Bash output:\n{output_text}")
+    return output_text
+
+def _preview_sqlite(inp, show=True):
+    if not show:
+        return
+    print(f"\nAbout to execute SQLite query on {inp['db_path']}:\n\n{inp['query']}")
+    if inp.get("output_json"):
+        print(f"Full results will be written to: {inp['output_json']}")
+    if inp.get("print_result", False):
+        print("Results will also be printed in the context window.")
+
+async def _run_sqlite(inp, _):
+    print(f"Executing SQL query: {inp['query']}")
+    output_text = await asyncio.to_thread(
+        execute_sqlite, inp["db_path"], inp["query"], inp.get("output_json"), inp.get("print_result", False)
+    )
+    print(f"SQLite output:\n{output_text}")
+    return output_text
+
+def _preview_ipython(inp, show=True):
+    if not show:
+        return
+    print(f"\nAbout to execute Python code with IPython:\n\n{inp['code']}")
+    if inp.get("print_result", False):
+        print("Result will also be printed in the context window.")
+
+async def _run_ipython(inp, _):
+    print(f"Executing Python code:")
+    # Runs on the event loop thread: it redirects the process-wide stdout/stderr,
+    # which would capture other tool calls' output if it ran in a worker thread
+    return execute_ipython(inp["code"], inp.get("print_result", False))
+
+def _preview_edit_file_diff(inp, show=True):
+    # The diff is parsed and applied once; the previewed content is what gets written
+    new_content, error = render_unified_diff(inp["file_path"], inp["diff"])
+    if not show:
+        return new_content, error
+    print(f"\nAbout to apply unified diff to {inp['file_path']}:")
+    print(inp["diff"])
+    if error:
+        print(f"\n[Preview failed: {error}]")
+    else:
+        print("\n--- Preview of file after applying diff ---\n")
+        print(new_content)
+    return new_content, error
+
+async def _run_edit_file_diff(inp, rendered):
+    new_content, error = rendered
+    print(f"Applying diff to {inp['file_path']}")
+    output_text = error or write_rendered_diff(inp["file_path"], new_content)
+    print(f"Diff output:\n{output_text}")
+    return output_text
+
+def _preview_overwrite_file(inp, show=True):
+    if not show:
+        return
+    print(f"\nAbout to overwrite {inp['file_path']} with new content.")
+    print("\n--- Preview of new file content ---\n")
+    print(inp["content"])
+
+async def _run_overwrite_file(inp, _):
+    print(f"Overwriting {inp['file_path']}")
+    output_text = overwrite_file(inp["file_path"], inp["content"])
+    print(f"Overwrite output:\n{output_text}")
+    return output_text
+
+# --- Memory tools run without confirmation ---
+
+@functools.lru_cache(maxsize=1)
+def get_memory_manager():
+    """The MemoryManager shared by the loop and every memory tool call; opening one re-runs schema setup."""
+    return MemoryManager()
+
+def _format_memory_block(memory, preview_chars=None):
+    content = memory['content']
+    if preview_chars is not None and len(content) > preview_chars:
+        content = content[:preview_chars] + "..."
+    tags = f"Tags: {', '.join(memory['tags'])}\n" if memory['tags'] else ""
+    return (f"\nID: {memory['id']}\nTitle: {memory['title']}\n{tags}"
+            f"Content: {content}\nCreated: {memory['created_at']}\n---")
+
+def _format_memory_list(header, memories, preview_chars=None):
+    # One string per memory and a single join, rather than five or six appends each
+    return "\n".join([header, *(_format_memory_block(memory, preview_chars) for memory in memories)])
+
+async def _run_save_memory(inp, _):
+    title = inp["title"]
+    print(f"\nSaving memory: {title}")
+    try:
+        memory_id = get_memory_manager().save_memory(title, inp["content"], inp.get("tags", []))
+        output_text = f"Memory saved successfully with ID: {memory_id}\nTitle: {title}"
+    except Exception as e:
+        output_text = f"Error saving memory: {str(e)}"
+    print(f"Memory output:\n{output_text}")
+    return output_text
+
+async def _run_search_memory(inp, _):
+    query = inp.get("query")
+    tags = inp.get("tags")
+    limit = inp.get("limit", 10)
+    print(f"\nSearching memories: query='{query}', tags={tags}, limit={limit}")
+    try:
+        memories = get_memory_manager().search_memories(query, tags, limit)
+        if not memories:
+            output_text = "No memories found matching the search criteria."
         else:
-            print("[Auto-confirm enabled: proceeding without prompt]")
-            confirm = ""
-        if confirm == "x":
-            print("Diff application skipped by user.")
-            output_text = "Diff application was skipped by user confirmation. Seek user input for next steps"
+            output_text = _format_memory_list(f"Found {len(memories)} memories:", memories)
+    except Exception as e:
+        output_text = f"Error searching memories: {str(e)}"
+    print(f"Search output:\n{output_text}")
+    return output_text
+
+async def _run_list_memories(inp, _):
+    limit = inp.get("limit", 20)
+    offset = inp.get("offset", 0)
+    print(f"\nListing memories: limit={limit}, offset={offset}")
+    try:
+        memories = get_memory_manager().list_memories(limit, offset)
+        if not memories:
+            output_text = "No memories found."
         else:
-            print(f"Applying diff to {file_path}")
-            output_text = apply_unified_diff(file_path, diff)
-            print(f"Diff output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(
-                type="text",
-                text=output_text
-            )]
-        )
-    elif tool_call["name"] == "overwrite_file":
-        file_path = tool_call["input"]["file_path"]
-        content = tool_call["input"]["content"]
-        print(f"\nAbout to overwrite {file_path} with new content.")
-        print("\n--- Preview of new file content ---\n")
-        print(content)
-        if not auto_confirm:
-            confirm = input("Enter to confirm or x to cancel").strip().lower()
+            header = f"Listing {len(memories)} memories (limit: {limit}, offset: {offset}):"
+            output_text = _format_memory_list(header, memories, preview_chars=100)
+    except Exception as e:
+        output_text = f"Error listing memories: {str(e)}"
+    print(f"List output:\n{output_text}")
+    return output_text
+
+async def _run_get_memory(inp, _):
+    memory_id = inp["memory_id"]
+    print(f"\nGetting memory: {memory_id}")
+    try:
+        memory = get_memory_manager().get_memory(memory_id)
+        if not memory:
+            output_text = f"Memory with ID {memory_id} not found."
         else:
-            print("[Auto-confirm enabled: proceeding without prompt]")
-            confirm = ""
-        if confirm == "x":
-            print("Overwrite skipped by user.")
-            output_text = "Overwrite was skipped by user confirmation. Seek user input for next steps"
+            tags = f"Tags: {', '.join(memory['tags'])}\n" if memory['tags'] else ""
+            output_text = (f"Memory ID: {memory['id']}\nTitle: {memory['title']}\nContent: {memory['content']}\n{tags}"
+                           f"Created: {memory['created_at']}\nUpdated: {memory['updated_at']}\n"
+                           f"Last Accessed: {memory['accessed_at']}")
+    except Exception as e:
+        output_text = f"Error retrieving memory: {str(e)}"
+    print(f"Get output:\n{output_text}")
+    return output_text
+
+async def _run_delete_memory(inp, _):
+    memory_id = inp["memory_id"]
+    print(f"\nDeleting memory: {memory_id}")
+    try:
+        if get_memory_manager().delete_memory(memory_id):
+            output_text = f"Memory with ID {memory_id} deleted successfully."
         else:
-            print(f"Overwriting {file_path}")
-            output_text = overwrite_file(file_path, content)
-            print(f"Overwrite output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(
-                type="text",
-                text=output_text
-            )]
-        )
-    elif tool_call["name"] == "save_memory":
-        title = tool_call["input"]["title"]
-        content = tool_call["input"]["content"]
-        tags = tool_call["input"].get("tags", [])
-        print(f"\nSaving memory: {title}")
-        memory_manager = MemoryManager()
-        try:
-            memory_id = memory_manager.save_memory(title, content, tags)
-            output_text = f"Memory saved successfully with ID: {memory_id}\nTitle: {title}"
-        except Exception as e:
-            output_text = f"Error saving memory: {str(e)}"
-        print(f"Memory output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(type="text", text=output_text)]
-        )
-    elif tool_call["name"] == "search_memory":
-        query = tool_call["input"].get("query")
-        tags = tool_call["input"].get("tags")
-        limit = tool_call["input"].get("limit", 10)
-        print(f"\nSearching memories: query='{query}', tags={tags}, limit={limit}")
-        memory_manager = MemoryManager()
-        try:
-            memories = memory_manager.search_memories(query, tags, limit)
-            if not memories:
-                output_text = "No memories found matching the search criteria."
-            else:
-                result_lines = [f"Found {len(memories)} memories:"]
-                for memory in memories:
-                    result_lines.append(f"\nID: {memory['id']}")
-                    result_lines.append(f"Title: {memory['title']}")
-                    if memory['tags']:
-                        result_lines.append(f"Tags: {', '.join(memory['tags'])}")
-                    result_lines.append(f"Content: {memory['content']}")
-                    result_lines.append(f"Created: {memory['created_at']}")
-                    result_lines.append("---")
-                output_text = "\n".join(result_lines)
-        except Exception as e:
-            output_text = f"Error searching memories: {str(e)}"
-        print(f"Search output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(type="text", text=output_text)]
-        )
-    elif tool_call["name"] == "list_memories":
-        limit = tool_call["input"].get("limit", 20)
-        offset = tool_call["input"].get("offset", 0)
-        print(f"\nListing memories: limit={limit}, offset={offset}")
-        memory_manager = MemoryManager()
-        try:
-            memories = memory_manager.list_memories(limit, offset)
-            if not memories:
-                output_text = "No memories found."
-            else:
-                result_lines = [f"Listing {len(memories)} memories (limit: {limit}, offset: {offset}):"]
-                for memory in memories:
-                    result_lines.append(f"\nID: {memory['id']}")
-                    result_lines.append(f"Title: {memory['title']}")
-                    if memory['tags']:
-                        result_lines.append(f"Tags: {', '.join(memory['tags'])}")
-                    content_preview = memory['content'][:100] + "..." if len(memory['content']) > 100 else memory['content']
-                    result_lines.append(f"Content: {content_preview}")
-                    result_lines.append(f"Created: {memory['created_at']}")
-                    result_lines.append("---")
-                output_text = "\n".join(result_lines)
-        except Exception as e:
-            output_text = f"Error listing memories: {str(e)}"
-        print(f"List output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(type="text", text=output_text)]
-        )
-    elif tool_call["name"] == "get_memory":
-        memory_id = tool_call["input"]["memory_id"]
-        print(f"\nGetting memory: {memory_id}")
-        memory_manager = MemoryManager()
-        try:
-            memory = memory_manager.get_memory(memory_id)
-            if not memory:
-                output_text = f"Memory with ID {memory_id} not found."
-            else:
-                result_lines = [
-                    f"Memory ID: {memory['id']}",
-                    f"Title: {memory['title']}",
-                    f"Content: {memory['content']}"
-                ]
-                if memory['tags']:
-                    result_lines.append(f"Tags: {', '.join(memory['tags'])}")
-                result_lines.extend([
-                    f"Created: {memory['created_at']}",
-                    f"Updated: {memory['updated_at']}",
-                    f"Last Accessed: {memory['accessed_at']}"
-                ])
-                output_text = "\n".join(result_lines)
-        except Exception as e:
-            output_text = f"Error retrieving memory: {str(e)}"
-        print(f"Get output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(type="text", text=output_text)]
-        )
-    elif tool_call["name"] == "delete_memory":
-        memory_id = tool_call["input"]["memory_id"]
-        print(f"\nDeleting memory: {memory_id}")
-        memory_manager = MemoryManager()
-        try:
-            success = memory_manager.delete_memory(memory_id)
-            if success:
-                output_text = f"Memory with ID {memory_id} deleted successfully."
-            else:
-                output_text = f"Memory with ID {memory_id} not found or could not be deleted."
-        except Exception as e:
-            output_text = f"Error deleting memory: {str(e)}"
-        print(f"Delete output:\n{output_text}")
-        return dict(
-            type="tool_result",
-            tool_use_id=tool_call["id"],
-            content=[dict(type="text", text=output_text)]
-        )
-    else:
+            output_text = f"Memory with ID {memory_id} not found or could not be deleted."
+    except Exception as e:
+        output_text = f"Error deleting memory: {str(e)}"
+    print(f"Delete output:\n{output_text}")
+    return output_text
+
+# name -> (preview, run, label used in skip messages); a preview of None means no confirmation
+_TOOL_HANDLERS = {
+    "bash": (_preview_bash, _run_bash, "Command execution"),
+    "sqlite": (_preview_sqlite, _run_sqlite, "SQL execution"),
+    "ipython": (_preview_ipython, _run_ipython, "Python execution"),
+    "edit_file_diff": (_preview_edit_file_diff, _run_edit_file_diff, "Diff application"),
+    "overwrite_file": (_preview_overwrite_file, _run_overwrite_file, "Overwrite"),
+    "save_memory": (None, _run_save_memory, None),
+    "search_memory": (None, _run_search_memory, None),
+    "list_memories": (None, _run_list_memories, None),
+    "get_memory": (None, _run_get_memory, None),
+    "delete_memory": (None, _run_delete_memory, None),
+}
+
+async def handle_tool_call(tool_call, auto_confirm=False, confirm_lock=None):
+    if tool_call["name"] not in _TOOL_HANDLERS:
         raise Exception(f"Unsupported tool: {tool_call['name']}")
+    preview, run, label = _TOOL_HANDLERS[tool_call["name"]]
+    inp = tool_call["input"]
+    state = None
+    if preview is not None and auto_confirm:
+        # Nobody is reviewing the preview, so only compute what run() needs
+        state = preview(inp, show=False)
+    elif preview is not None:
+        if confirm_lock is None:
+            confirm_lock = asyncio.Lock()
+        async with confirm_lock:
+            state = preview(inp)
+            confirm = await _confirm()
+        if confirm == "x":
+            print(f"{label} skipped by user.")
+            return _tool_result(
+                tool_call["id"],
+                f"{label} was skipped by user confirmation. Seek user input for next steps"
+            )
+    return _tool_result(tool_call["id"], await run(inp, state))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
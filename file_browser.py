@@ -5,31 +5,42 @@ A web-based file browser with preview, upload, and download capabilities.
 """
 
 import os
+import re
+import fnmatch
 import json
 import mimetypes
 import base64
+import io
+import codecs
 import zipfile
-import tempfile
 import shutil
-from pathlib import Path
+import functools
+import stat as stat_module
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import unquote
 from werkzeug.utils import secure_filename
-from werkzeug.exceptions import NotFound, Forbidden
+from werkzeug.exceptions import HTTPException, BadRequest, NotFound, Forbidden
 
 from flask import (
     Flask, render_template, request, jsonify, send_file, 
-    abort, redirect, url_for, flash, session
+    abort, redirect, url_for, flash, session, Response
 )
 from flask_socketio import SocketIO
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload
+# Listings can hold thousands of entries: emit compact JSON (indenting falls off the C encoder) in insertion order
+app.json.compact = True
+app.json.sort_keys = False
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 # Configuration
 ROOT_PATH = os.path.abspath('.')  # Start from current directory
+_ROOT_REAL = os.path.realpath(ROOT_PATH).rstrip(os.sep) + os.sep  # ROOT_PATH never changes; resolve it once
 ALLOWED_EXTENSIONS = {'txt', 'py', 'js', 'html', 'css', 'json', 'xml', 'md', 'yml', 'yaml', 'ini', 'cfg', 'conf'}
 IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'svg', 'webp'}
 ARCHIVE_EXTENSIONS = {'zip', 'tar', 'gz', 'rar', '7z'}
@@ -46,115 +57,191 @@ BLOCKED_PATTERNS = {
     '*.key',
     '*.pem'
 }
+# Already-compressed formats are stored as-is in zip downloads; deflating them costs CPU for no gain
+_INCOMPRESSIBLE_EXTENSIONS = IMAGE_EXTENSIONS | ARCHIVE_EXTENSIONS | {'mp3', 'mp4', 'ogg', 'flac', 'mkv', 'mov', 'avi', 'pdf', 'whl', 'jar', 'xz', 'bz2'}
+ZIP_CHUNK_SIZE = 1024 * 1024
+PREVIEW_TEXT_BYTES = 10000
+PREVIEW_SNIFF_BYTES = 512
+ZIP_PREFETCH_WORKERS = 4
+UPLOAD_COPY_BUFFER_SIZE = 1024 * 1024  # werkzeug's default is 16KB
+
+_UNSAFE_FILENAME_RE = re.compile(r'[^A-Za-z0-9._-]+')
+
+def _split_blocked_patterns(patterns):
+    """Sort blocked globs into exact names, prefixes, suffixes and a regex for anything more complex"""
+    names, prefixes, suffixes, globs = set(), [], [], []
+    for pattern in patterns:
+        body = pattern.strip('*')
+        if any(c in body for c in '*?['):
+            globs.append(pattern)
+        elif pattern == body:
+            names.add(pattern)
+        elif pattern == body + '*':
+            prefixes.append(body)
+        elif pattern == '*' + body:
+            suffixes.append(body)
+        else:
+            globs.append(pattern)
+    regex = re.compile('|'.join(fnmatch.translate(pattern) for pattern in globs)) if globs else None
+    return frozenset(names), tuple(prefixes), tuple(suffixes), regex
+
+# Nearly every blocked glob is a plain name, prefix or suffix, so most names are settled with string compares
+_BLOCKED_NAMES, _BLOCKED_PREFIXES, _BLOCKED_SUFFIXES, _BLOCKED_GLOB_RE = _split_blocked_patterns(BLOCKED_PATTERNS)
+
+def _is_blocked_name(name):
+    """Check a single path component against the blocked patterns"""
+    if name in _BLOCKED_NAMES or name.startswith(_BLOCKED_PREFIXES) or name.endswith(_BLOCKED_SUFFIXES):
+        return True
+    return _BLOCKED_GLOB_RE is not None and _BLOCKED_GLOB_RE.match(name) is not None
+
+def _sanitize_filename(name):
+    """Reduce a client-supplied name to a safe single path component; empty if nothing safe is left"""
+    if not name.isascii():
+        # Only non-ASCII names need werkzeug's unicode normalization
+        return secure_filename(name)
+    return _UNSAFE_FILENAME_RE.sub('_', name).strip('._')
 
 def is_safe_path(path):
     """Check if path is safe to access"""
     try:
-        real_path = os.path.realpath(path)
-        root_real = os.path.realpath(ROOT_PATH)
-        return real_path.startswith(root_real)
+        # Trailing separator on both sides so /root_backup does not pass as inside /root
+        return (os.path.realpath(path) + os.sep).startswith(_ROOT_REAL)
     except:
         return False
 
 def is_blocked_path(path):
     """Check if path matches blocked patterns"""
-    path_name = os.path.basename(path)
-    return any(pattern.replace('*', '') in path_name for pattern in BLOCKED_PATTERNS)
+    return _is_blocked_name(os.path.basename(path))
 
-def get_file_info(path):
-    """Get detailed file information"""
+@functools.lru_cache(maxsize=1024)
+def _mime_for_ext(ext):
+    """Guess a MIME type from a lowercase extension; listings repeat the same few extensions"""
+    if not ext:
+        return 'application/octet-stream'
+    return mimetypes.types_map.get('.' + ext) or mimetypes.guess_type('x.' + ext)[0] or 'application/octet-stream'
+
+@functools.lru_cache(maxsize=1024)
+def _is_text_ext(ext):
+    """Whether files with this extension get a text preview"""
+    return ext in ALLOWED_EXTENSIONS or _mime_for_ext(ext).startswith('text/')
+
+def _build_file_info(name, path, stat):
+    """Build the file info dict from a single stat result"""
+    is_dir = stat_module.S_ISDIR(stat.st_mode)
+    # Directories get no extension parsing or MIME guess; nothing downstream uses either for them
+    ext = '' if is_dir else os.path.splitext(name)[1].lower().lstrip('.')
+    return {
+        'name': name,
+        'path': path,
+        'size': stat.st_size,
+        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        'is_dir': is_dir,
+        'is_file': not is_dir and stat_module.S_ISREG(stat.st_mode),
+        'extension': ext,
+        'mime_type': 'inode/directory' if is_dir else _mime_for_ext(ext)
+    }
+
+def get_file_info(path, stat=None):
+    """Get detailed file information, reusing stat when the caller already has it"""
     try:
-        stat = os.stat(path)
-        return {
-            'name': os.path.basename(path),
-            'path': path,
-            'size': stat.st_size,
-            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            'is_dir': os.path.isdir(path),
-            'is_file': os.path.isfile(path),
-            'extension': Path(path).suffix.lower().lstrip('.'),
-            'mime_type': mimetypes.guess_type(path)[0] or 'application/octet-stream'
-        }
+        return _build_file_info(os.path.basename(path), path, stat or os.stat(path))
     except (OSError, IOError):
         return None
 
+def get_file_info_from_entry(entry):
+    """Get file information for an os.scandir entry, reusing the stat it caches"""
+    try:
+        return _build_file_info(entry.name, entry.path, entry.stat())
+    except (OSError, IOError):
+        return None
+
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
 def format_file_size(size):
     """Format file size in human readable format"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size < 1024.0:
-            return f"{size:.1f} {unit}"
-        size /= 1024.0
-    return f"{size:.1f} PB"
+    # Each unit is 2**10 of the previous one, so the bit length picks the unit directly
+    idx = min(5, (int(size).bit_length() - 1) // 10) if size >= 1 else 0
+    return f"{size / (1 << (10 * idx)):.1f} {_SIZE_UNITS[idx]}"
+
+# Extension -> icon, built once; anything not listed gets the generic document icon
+_ICON_BY_EXT = {
+    **{ext: '📄' for ext in ('js', 'ts', 'pdf')},
+    **{ext: '🌐' for ext in ('html', 'htm')},
+    **{ext: '🎨' for ext in ('css', 'scss', 'sass')},
+    **{ext: '⚙️' for ext in ('json', 'yaml', 'yml', 'xml')},
+    **{ext: '📝' for ext in ('txt', 'md', 'rst')},
+    **{ext: '🎵' for ext in ('mp3', 'wav', 'flac', 'ogg')},
+    **{ext: '🎬' for ext in ('mp4', 'avi', 'mov', 'mkv')},
+    **{ext: '📦' for ext in ARCHIVE_EXTENSIONS},
+    'py': '🐍',
+    **{ext: '🖼️' for ext in IMAGE_EXTENSIONS},
+}
 
 def get_file_icon(file_info):
     """Get appropriate icon for file type"""
     if file_info['is_dir']:
         return '📁'
-    
-    ext = file_info['extension']
-    if ext in IMAGE_EXTENSIONS:
-        return '🖼️'
-    elif ext in ['py']:
-        return '🐍'
-    elif ext in ['js', 'ts']:
-        return '📄'
-    elif ext in ['html', 'htm']:
-        return '🌐'
-    elif ext in ['css', 'scss', 'sass']:
-        return '🎨'
-    elif ext in ['json', 'yaml', 'yml', 'xml']:
-        return '⚙️'
-    elif ext in ['txt', 'md', 'rst']:
-        return '📝'
-    elif ext in ARCHIVE_EXTENSIONS:
-        return '📦'
-    elif ext in ['pdf']:
-        return '📄'
-    elif ext in ['mp3', 'wav', 'flac', 'ogg']:
-        return '🎵'
-    elif ext in ['mp4', 'avi', 'mov', 'mkv']:
-        return '🎬'
-    else:
-        return '📄'
+    return _ICON_BY_EXT.get(file_info['extension'], '📄')
+
+def _resolve_path(path, want=None, missing='Path not found'):
+    """Security-check a request path and stat it once.
+    
+    want is None, 'dir' or 'file'. Returns the stat result; failures raise an HTTPException
+    whose description becomes the JSON error.
+    """
+    if not path:
+        raise BadRequest('No path specified')
+    if not is_safe_path(path) or is_blocked_path(path):
+        raise Forbidden('Access denied')
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        raise NotFound(missing)
+    if want == 'dir' and not stat_module.S_ISDIR(path_stat.st_mode):
+        raise BadRequest('Path is not a directory')
+    if want == 'file' and not stat_module.S_ISREG(path_stat.st_mode):
+        raise NotFound(missing)
+    return path_stat
+
+@app.errorhandler(HTTPException)
+def api_http_error(e):
+    """Keep API errors in the {'error': ...} shape the frontend reads"""
+    if request.path.startswith('/api/'):
+        return jsonify({'error': e.description}), e.code
+    return e
 
 @app.route('/')
 def index():
     """Render main file browser interface"""
     return render_template('file_browser.html')
 
+def _name_sort_key(file_info):
+    return file_info['name'].lower()
+
 @app.route('/api/files')
 def list_files():
     """List files and directories at given path"""
-    path = request.args.get('path', ROOT_PATH)
-    path = unquote(path)
-    
-    # Security checks
-    if not is_safe_path(path) or is_blocked_path(path):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    if not os.path.exists(path):
-        return jsonify({'error': 'Path not found'}), 404
-    
-    if not os.path.isdir(path):
-        return jsonify({'error': 'Path is not a directory'}), 400
+    path = unquote(request.args.get('path', ROOT_PATH))
+    _resolve_path(path, want='dir')
     
     try:
-        items = []
-        for item_name in sorted(os.listdir(path)):
-            item_path = os.path.join(path, item_name)
-            
-            # Skip blocked items
-            if is_blocked_path(item_path):
-                continue
-            
-            file_info = get_file_info(item_path)
-            if file_info:
-                file_info['icon'] = get_file_icon(file_info)
-                file_info['size_formatted'] = format_file_size(file_info['size'])
-                items.append(file_info)
+        dirs, files = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # Skip blocked items
+                if _is_blocked_name(entry.name):
+                    continue
+                
+                file_info = get_file_info_from_entry(entry)
+                if file_info:
+                    file_info['icon'] = get_file_icon(file_info)
+                    file_info['size_formatted'] = format_file_size(file_info['size'])
+                    (dirs if file_info['is_dir'] else files).append(file_info)
         
-        # Sort: directories first, then files
-        items.sort(key=lambda x: (not x['is_dir'], x['name'].lower()))
+        # Directories first, then files; each partition sorted once by name
+        dirs.sort(key=_name_sort_key)
+        files.sort(key=_name_sort_key)
+        items = dirs + files
         
         return jsonify({
             'success': True,
@@ -168,96 +255,194 @@ def list_files():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+class _ZipSink(io.RawIOBase):
+    """Unseekable write target that collects zip output until the generator hands it to the client"""
+    def __init__(self):
+        self.buffer = bytearray()
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+    
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def _prefetch_zip_entry(full_path, arcname):
+    """Stat and open a file for the archive, reading it up front when it fits in one chunk.
+    
+    Returns (zinfo, data, src) with exactly one of data/src set, or None if the file can't be read
+    (permissions, vanished mid-walk); such files are left out rather than failing the download.
+    """
+    try:
+        zinfo = zipfile.ZipInfo.from_file(full_path, arcname)
+        ext = os.path.splitext(full_path)[1].lower().lstrip('.')
+        zinfo.compress_type = zipfile.ZIP_STORED if ext in _INCOMPRESSIBLE_EXTENSIONS else zipfile.ZIP_DEFLATED
+        src = open(full_path, 'rb')
+    except OSError:
+        return None
+    if zinfo.file_size > ZIP_CHUNK_SIZE:
+        # Larger files are copied chunk by chunk from this handle, so they are never opened twice
+        return zinfo, None, src
+    with src:
+        try:
+            return zinfo, src.read(), None
+        except OSError:
+            return None
+
+def _zip_directory(dir_path):
+    """Yield a zip archive of dir_path chunk by chunk, skipping blocked files and directories"""
+    entries = []
+    for root, dirs, files in os.walk(dir_path):
+        # Filter out blocked directories
+        dirs[:] = [d for d in dirs if not _is_blocked_name(d)]
+        for file in files:
+            if not _is_blocked_name(file):
+                full_path = os.path.join(root, file)
+                entries.append((full_path, os.path.relpath(full_path, dir_path)))
+    
+    sink = _ZipSink()
+    with ThreadPoolExecutor(max_workers=ZIP_PREFETCH_WORKERS) as pool, \
+            zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        # Keep a bounded window of reads in flight so disk I/O overlaps with deflate
+        pending = deque()
+        remaining = iter(entries)
+        for full_path, arcname in itertools.islice(remaining, ZIP_PREFETCH_WORKERS * 2):
+            pending.append(pool.submit(_prefetch_zip_entry, full_path, arcname))
+        
+        try:
+            while pending:
+                future = pending.popleft()
+                for next_path, next_arcname in itertools.islice(remaining, 1):
+                    pending.append(pool.submit(_prefetch_zip_entry, next_path, next_arcname))
+                entry = future.result()
+                if entry is None:
+                    # Nothing of this entry has been written, so it can simply be left out
+                    continue
+                zinfo, data, src = entry
+                if src is None:
+                    zipf.writestr(zinfo, data)
+                else:
+                    # Once the local header is out, a read error has to abort the stream: skipping the rest would
+                    # leave a truncated member that doesn't match its central directory entry
+                    with src, zipf.open(zinfo, 'w') as dest:
+                        while True:
+                            chunk = src.read(ZIP_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            if sink.buffer:
+                                yield sink.take()
+                yield sink.take()
+        finally:
+            # An aborted or abandoned download leaves prefetched large files open
+            for future in pending:
+                if not future.cancel():
+                    entry = future.result()
+                    if entry is not None and entry[2] is not None:
+                        entry[2].close()
+    yield sink.take()
+
 @app.route('/api/download')
 def download_file():
     """Download a file"""
-    file_path = request.args.get('path')
-    if not file_path:
-        return jsonify({'error': 'No path specified'}), 400
-    
-    file_path = unquote(file_path)
-    
-    # Security checks
-    if not is_safe_path(file_path) or is_blocked_path(file_path):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    if not os.path.exists(file_path):
-        return jsonify({'error': 'File not found'}), 404
-    
-    if os.path.isdir(file_path):
-        # Create a zip file for directories
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.zip')
-        try:
-            with zipfile.ZipFile(temp_file.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, dirs, files in os.walk(file_path):
-                    # Filter out blocked directories
-                    dirs[:] = [d for d in dirs if not is_blocked_path(os.path.join(root, d))]
-                    
-                    for file in files:
-                        full_path = os.path.join(root, file)
-                        if not is_blocked_path(full_path):
-                            arc_path = os.path.relpath(full_path, file_path)
-                            zipf.write(full_path, arc_path)
-            
-            return send_file(
-                temp_file.name,
-                as_attachment=True,
-                download_name=f"{os.path.basename(file_path)}.zip",
-                mimetype='application/zip'
-            )
-        except Exception as e:
-            if os.path.exists(temp_file.name):
-                os.unlink(temp_file.name)
-            return jsonify({'error': str(e)}), 500
+    file_path = unquote(request.args.get('path', ''))
+    file_stat = _resolve_path(file_path, missing='File not found')
+    
+    if stat_module.S_ISDIR(file_stat.st_mode):
+        # Stream a zip of the directory as it is built
+        response = Response(_zip_directory(file_path), mimetype='application/zip')
+        response.headers.set('Content-Disposition', 'attachment', filename=f"{os.path.basename(file_path)}.zip")
+        return response
     else:
         # Send individual file
         try:
+            # Conditional + ETag lets repeat downloads revalidate to a 304 and resume with Range;
+            # max_age=0 makes browsers revalidate since files here change underneath them
             return send_file(
                 file_path,
                 as_attachment=True,
-                download_name=os.path.basename(file_path)
+                download_name=os.path.basename(file_path),
+                conditional=True,
+                etag=True,
+                last_modified=file_stat.st_mtime,
+                max_age=0
             )
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
+_IMAGE_MAGIC = (
+    (b'\x89PNG', 'image/png'),
+    (b'\xff\xd8', 'image/jpeg'),
+    (b'GIF8', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+def _sniff_raster_mime(head):
+    """MIME type of a raster image recognised by its magic bytes, else None; these can't carry script"""
+    for magic, mime in _IMAGE_MAGIC:
+        if head.startswith(magic):
+            return mime
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def _sniff_preview(head, ext, ext_mime):
+    """Classify a file as 'text', 'image' or 'binary' from its first bytes, using the extension only when those are inconclusive"""
+    raster_mime = _sniff_raster_mime(head)
+    if raster_mime:
+        return 'image', raster_mime
+    if not head:
+        return ('text' if _is_text_ext(ext) else 'binary'), ext_mime
+    # No known magic: image extensions (SVG, formats not sniffed above) keep their verdict
+    if ext in IMAGE_EXTENSIONS:
+        return 'image', ext_mime
+    if b'\x00' in head or ext in _INCOMPRESSIBLE_EXTENSIONS:
+        return 'binary', ext_mime
+    return 'text', ext_mime
+
 @app.route('/api/preview')
 def preview_file():
     """Preview file content"""
-    file_path = request.args.get('path')
-    if not file_path:
-        return jsonify({'error': 'No path specified'}), 400
-    
-    file_path = unquote(file_path)
+    file_path = unquote(request.args.get('path', ''))
+    file_stat = _resolve_path(file_path, want='file', missing='File not found')
     
-    # Security checks
-    if not is_safe_path(file_path) or is_blocked_path(file_path):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    if not os.path.exists(file_path) or not os.path.isfile(file_path):
-        return jsonify({'error': 'File not found'}), 404
-    
-    file_info = get_file_info(file_path)
+    file_info = get_file_info(file_path, file_stat)
     if not file_info:
         return jsonify({'error': 'Cannot read file info'}), 500
     
     try:
         ext = file_info['extension']
-        mime_type = file_info['mime_type']
+        with open(file_path, 'rb') as f:
+            raw = f.read(PREVIEW_TEXT_BYTES + 1)  # One extra byte tells a full-length file from a truncated one
+        kind, mime_type = _sniff_preview(raw[:PREVIEW_SNIFF_BYTES], ext, file_info['mime_type'])
         
         # Text files
-        if ext in ALLOWED_EXTENSIONS or mime_type.startswith('text/'):
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read(10000)  # Limit to first 10KB
+        if kind == 'text':
+            # A non-final decode holds back a multibyte sequence split at the cut instead of mangling it
+            content = codecs.getincrementaldecoder('utf-8')('replace').decode(raw[:PREVIEW_TEXT_BYTES])
+            return jsonify({
+                'success': True,
+                'type': 'text',
+                'content': content,
+                'truncated': len(raw) > PREVIEW_TEXT_BYTES,
+                'file_info': file_info
+            })
+        
+        # Raster images are served by /api/raw so the browser fetches the bytes directly; SVG and other
+        # unsniffed formats go inline as a data URI, which an <img> renders without running script
+        elif kind == 'image':
+            if request.args.get('inline') != '1' and _sniff_raster_mime(raw[:PREVIEW_SNIFF_BYTES]):
                 return jsonify({
                     'success': True,
-                    'type': 'text',
-                    'content': content,
-                    'truncated': len(content) == 10000,
+                    'type': 'image',
+                    'content': url_for('raw_file', path=file_path),
                     'file_info': file_info
                 })
-        
-        # Images
-        elif ext in IMAGE_EXTENSIONS:
             with open(file_path, 'rb') as f:
                 content = f.read(1024 * 1024)  # Limit to 1MB
                 base64_content = base64.b64encode(content).decode('utf-8')
@@ -280,18 +465,30 @@ def preview_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/raw')
+def raw_file():
+    """Serve a raster image inline, or any other file as a download, with Range and conditional request support"""
+    file_path = unquote(request.args.get('path', ''))
+    _resolve_path(file_path, want='file', missing='File not found')
+    
+    # Only raster images recognised by their magic bytes are rendered in place. Anything else, e.g. an
+    # uploaded .html or .svg, would run its script same-origin, so it is sent as an attachment instead.
+    with open(file_path, 'rb') as f:
+        mime_type = _sniff_raster_mime(f.read(PREVIEW_SNIFF_BYTES))
+    if mime_type:
+        response = send_file(file_path, mimetype=mime_type, conditional=True, etag=True, max_age=0)
+    else:
+        response = send_file(file_path, mimetype='application/octet-stream', as_attachment=True,
+                             conditional=True, etag=True, max_age=0)
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    return response
+
 @app.route('/api/upload', methods=['POST'])
 def upload_files():
     """Upload files to specified directory"""
-    target_path = request.form.get('path', ROOT_PATH)
-    target_path = unquote(target_path)
-    
-    # Security checks
-    if not is_safe_path(target_path):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    if not os.path.exists(target_path) or not os.path.isdir(target_path):
-        return jsonify({'error': 'Invalid target directory'}), 400
+    target_path = unquote(request.form.get('path', ROOT_PATH))
+    _resolve_path(target_path, want='dir', missing='Invalid target directory')
     
     if 'files' not in request.files:
         return jsonify({'error': 'No files uploaded'}), 400
@@ -300,23 +497,30 @@ def upload_files():
     uploaded_files = []
     errors = []
     
+    # One directory read up front; conflict suffixes are then picked without a stat per candidate
+    try:
+        with os.scandir(target_path) as entries:
+            existing = {entry.name for entry in entries}
+    except OSError as e:
+        return jsonify({'error': f'Cannot read target directory: {e}'}), 500
+    
     for file in files:
         if file.filename == '':
             continue
         
         try:
-            filename = secure_filename(file.filename)
-            file_path = os.path.join(target_path, filename)
+            filename = _sanitize_filename(file.filename) or 'unnamed'
             
             # Handle filename conflicts
             counter = 1
             base_name, ext = os.path.splitext(filename)
-            while os.path.exists(file_path):
-                new_filename = f"{base_name}_{counter}{ext}"
-                file_path = os.path.join(target_path, new_filename)
+            while filename in existing:
+                filename = f"{base_name}_{counter}{ext}"
                 counter += 1
+            existing.add(filename)
+            file_path = os.path.join(target_path, filename)
             
-            file.save(file_path)
+            file.save(file_path, buffer_size=UPLOAD_COPY_BUFFER_SIZE)
             file_info = get_file_info(file_path)
             if file_info:
                 file_info['icon'] = get_file_icon(file_info)
@@ -348,7 +552,9 @@ def create_folder():
     if not is_safe_path(parent_path):
         return jsonify({'error': 'Access denied'}), 403
     
-    folder_name = secure_filename(folder_name)
+    folder_name = _sanitize_filename(folder_name)
+    if not folder_name:
+        return jsonify({'error': 'Invalid folder name'}), 400
     folder_path = os.path.join(parent_path, folder_name)
     
     if os.path.exists(folder_path):
@@ -372,25 +578,15 @@ def create_folder():
 @app.route('/api/delete', methods=['DELETE'])
 def delete_item():
     """Delete a file or directory"""
-    item_path = request.args.get('path')
-    if not item_path:
-        return jsonify({'error': 'No path specified'}), 400
-    
-    item_path = unquote(item_path)
-    
-    # Security checks
-    if not is_safe_path(item_path) or is_blocked_path(item_path):
-        return jsonify({'error': 'Access denied'}), 403
-    
-    if not os.path.exists(item_path):
-        return jsonify({'error': 'Item not found'}), 404
+    item_path = unquote(request.args.get('path', ''))
+    item_stat = _resolve_path(item_path, missing='Item not found')
     
     # Don't allow deletion of root path
     if os.path.abspath(item_path) == os.path.abspath(ROOT_PATH):
         return jsonify({'error': 'Cannot delete root directory'}), 403
     
     try:
-        if os.path.isdir(item_path):
+        if stat_module.S_ISDIR(item_stat.st_mode):
             shutil.rmtree(item_path)
         else:
             os.remove(item_path)
@@ -61,6 +61,7 @@
         pythonPackages =
           ps: with ps; [
             anthropic
+            httpx
             tenacity
             matplotlib
             ipython
@@ -77,7 +78,6 @@
             torch-tb-profiler
             opencv-python
             nbconvert
-            patch
             kubernetes
             flask
             flask-socketio
@@ -11,10 +11,146 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
 import json
+import hashlib
+import codecs
+import threading
+import itertools
+import multiprocessing
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+FILE_READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_PIPELINE_DEPTH = 2
+CLONE_STDERR_TAIL_LINES = 20
+MAX_OPEN_STORES = 8
+RAG_LLM_MODEL = "gpt-4o-mini"  # Faster per token than gpt-3.5-turbo, at lower cost
+MAX_READ_BYTES = 1_000_000
+BINARY_SNIFF_BYTES = 8192
+PARALLEL_SPLIT_MIN_DOCUMENTS = 200  # Below this, process start-up costs more than the split
+BINARY_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.tar', '.gz', '.exe', '.dll', '.so', '.dylib', '.woff', '.woff2', '.ttf', '.otf',
+                               '.ico', '.bmp', '.webp', '.mp3', '.mp4', '.pyc', '.class', '.o', '.a', '.wasm'})
+DEFAULT_IGNORE_DIRS = frozenset({'.git', 'node_modules', '__pycache__', '.idea', '.vscode', 'venv', '.env', 'target', 'build', 'dist'})
+# Control bytes that do not occur in text; bytes >= 0x80 are left alone since UTF-8 and latin-1 text use them
+_NON_TEXT_BYTES = bytes(set(range(32)) - {0x08, 0x09, 0x0a, 0x0c, 0x0d, 0x1b}) + b'\x7f'
+BINARY_CONTROL_RATIO = 0.3
+
+RAG_PROMPT_TEMPLATE = """You are an expert code analyst. Use the following code snippets from the repository to answer the question.
+            Provide a comprehensive answer and include specific citations with file paths and relevant code snippets.
+
+Question: {question}
+
+Code Context:
+{context}
+
+Instructions:
+1. Answer the question based on the provided code context
+2. Include specific file references in your answer
+3. Quote relevant code snippets when helpful
+4. If the answer isn't in the provided context, say so clearly
+
+Answer:"""
+
+def format_docs_with_citations(docs):
+    formatted = []
+    for i, doc in enumerate(docs, 1):
+        file_path = doc.metadata.get('file_path', 'unknown')
+        content = doc.page_content
+        formatted.append(f"[Source {i}: {file_path}]\n{content}")
+    return "\n\n".join(formatted)
+
+def _split_document_shard(documents, chunk_size: int, chunk_overlap: int):
+    """Split one shard of documents; module-level so worker processes can run it."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", " ", ""]
+    )
+    return text_splitter.split_documents(documents)
+
+def _split_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Process pool for splitting whose workers don't start as forks of this process.
+    
+    The indexer runs inside threaded servers (and next to its own reader threads); a fork copies
+    locks other threads may hold at that moment, which can deadlock the child.
+    """
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+
+def _cut_at_file_boundary(chunks, max_chunk_count: Optional[int]):
+    """Keep at most max_chunk_count chunks without cutting through one file's chunks.
+    
+    A partly indexed file would be recorded with its current hash and never revisited. If the first file
+    alone is over the cap, its leading chunks are kept with an empty file_hash so the next run retries it.
+    """
+    if max_chunk_count is None or len(chunks) <= max_chunk_count:
+        return chunks
+    logger.warning(f"Repository has {len(chunks)} chunks, limiting to {max_chunk_count} to prevent token overflow")
+    cut = max_chunk_count
+    straddling = chunks[cut].metadata["file_path"]
+    while cut and chunks[cut - 1].metadata["file_path"] == straddling:
+        cut -= 1
+    if cut == 0:
+        cut = max_chunk_count
+        for chunk in chunks[:cut]:
+            chunk.metadata["file_hash"] = ""
+    return chunks[:cut]
+
+def _bom_encoding(head: bytes) -> Optional[str]:
+    """Codec named by a leading byte-order mark, if any; the codecs chosen strip the BOM."""
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    return None
+
+def _content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+class DedupEmbeddings:
+    """Embeddings wrapper for one indexing run that sends each distinct chunk text to the API only once.
+    
+    A vector is kept only until the last duplicate of its text has been embedded, so memory is bounded
+    by the duplicates still ahead rather than by the whole corpus.
+    """
+    
+    def __init__(self, base, texts: List[str]):
+        self.base = base
+        self.reused = 0
+        self._remaining = Counter(_content_hash(text) for text in texts)
+        self._vectors = {}
+        # Batches may be embedded from several threads; the API call itself runs outside the lock
+        self._lock = threading.Lock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [_content_hash(text) for text in texts]
+        missing = {}
+        with self._lock:
+            for text_hash, text in zip(hashes, texts):
+                if text_hash not in self._vectors and text_hash not in missing:
+                    missing[text_hash] = text
+        fresh = dict(zip(missing, self.base.embed_documents(list(missing.values())))) if missing else {}
+        
+        vectors = []
+        with self._lock:
+            self._vectors.update(fresh)
+            self.reused += len(texts) - len(missing)
+            for text_hash in hashes:
+                vectors.append(self._vectors[text_hash])
+                self._remaining[text_hash] -= 1
+                if self._remaining[text_hash] <= 0:
+                    del self._vectors[text_hash]
+        return vectors
+    
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
 class GitHubRAG:
     """GitHub Repository RAG (Retrieval Augmented Generation) system."""
     
@@ -26,9 +162,13 @@ class GitHubRAG:
         
         self.openai_api_key = openai_api_key
         self.persist_directory = persist_directory
-        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-        self.llm = ChatOpenAI(openai_api_key=openai_api_key, model_name="gpt-3.5-turbo", temperature=0)
+        # chunk_size is how many texts go into each embeddings API request
+        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key, chunk_size=EMBEDDING_BATCH_SIZE, max_retries=6)
+        self.llm = ChatOpenAI(openai_api_key=openai_api_key, model_name=RAG_LLM_MODEL, temperature=0)
         self.repositories = {}  # Track indexed repositories
+        self._stores = OrderedDict()  # collection_name -> opened Chroma store, least recently used first
+        self._retrievers = {}  # (collection_name, max_results) -> retriever
+        self._answer_chain = None  # Built on first query; the same for every collection
         
         # Create persist directory with proper permissions
         os.makedirs(persist_directory, exist_ok=True)
@@ -53,11 +193,36 @@ class GitHubRAG:
         """Save the repository index."""
         index_file = os.path.join(self.persist_directory, "repo_index.json")
         try:
+            # json.dumps without indent runs on the C encoder; json.dump always falls back to pure Python
+            data = json.dumps(self.repositories, separators=(',', ':'))
             with open(index_file, 'w') as f:
-                json.dump(self.repositories, f, indent=2)
+                f.write(data)
         except Exception as e:
             logger.error(f"Could not save repository index: {e}")
     
+    def _file_hashes_path(self, collection_name: str) -> str:
+        return os.path.join(self.persist_directory, f"{collection_name}_files.json")
+    
+    def _load_file_hashes(self, collection_name: str) -> Optional[Dict[str, list]]:
+        """Load {file_path: [file_hash, chunk_count]} for an indexed collection, or None if it was never recorded."""
+        try:
+            with open(self._file_hashes_path(collection_name), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not load file hashes for {collection_name}: {e}")
+            return None
+    
+    def _save_file_hashes(self, collection_name: str, file_hashes: Dict[str, list]):
+        """Save the per-file hashes used to re-index a collection incrementally."""
+        try:
+            data = json.dumps(file_hashes, separators=(',', ':'))
+            with open(self._file_hashes_path(collection_name), 'w') as f:
+                f.write(data)
+        except Exception as e:
+            logger.error(f"Could not save file hashes for {collection_name}: {e}")
+    
     def clone_github_repo(self, repo_url: str, target_dir: str, shallow: bool = True) -> str:
         """Clone a GitHub repository."""
         logger.info(f"Cloning repository: {repo_url}")
@@ -68,113 +233,264 @@ class GitHubRAG:
         
         clone_cmd = ['git', 'clone']
         if shallow:
-            clone_cmd.extend(['--depth', '1'])
+            # Only HEAD is indexed: skip other branches and tags along with history
+            clone_cmd.extend(['--depth', '1', '--single-branch', '--no-tags'])
         clone_cmd.extend([repo_url, repo_path])
         
-        subprocess.run(clone_cmd, check=True)
+        # Stream git's progress into the log instead of letting it pile up; keep only a tail for errors
+        proc = subprocess.Popen(clone_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, bufsize=1)
+        stderr_tail = deque(maxlen=CLONE_STDERR_TAIL_LINES)
+        for line in proc.stderr:
+            line = line.rstrip()
+            if line:
+                logger.debug(f"git clone: {line}")
+                stderr_tail.append(line)
+        if proc.wait() != 0:
+            logger.error("git clone failed:\n" + "\n".join(stderr_tail))
+            raise subprocess.CalledProcessError(proc.returncode, clone_cmd, stderr="\n".join(stderr_tail))
         logger.info(f"Repository cloned to: {repo_path}")
         
         return repo_path
     
-    def should_process_file(self, file_path: str, ignore_dirs: List[str], include_extensions: Optional[List[str]], max_file_size: int = 100000) -> bool:
+    def _iter_files(self, repo_path: str, ignore_dirs):
+        """Yield (path, name, size) for every file under repo_path, never descending into ignored directories."""
+        ignore_set = frozenset(ignore_dirs)
+        stack = [repo_path]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if entry.name not in ignore_set:
+                                    stack.append(entry.path)
+                            elif entry.is_file():
+                                yield entry.path, entry.name, entry.stat().st_size
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+    
+    def should_process_file(self, file_path: str, ignore_dirs: frozenset, include_extensions: Optional[List[str]], max_file_size: int = 100000, size: Optional[int] = None) -> bool:
         """Determine if a file should be processed."""
-        for ignore_dir in ignore_dirs:
-            if f"/{ignore_dir}/" in file_path or file_path.startswith(f"{ignore_dir}/"):
-                return False
-        
-        # Check file size
-        try:
-            if os.path.getsize(file_path) > max_file_size:
-                logger.warning(f"Skipping large file {file_path} (size: {os.path.getsize(file_path)} bytes)")
-                return False
-        except OSError:
+        # Set membership on the directory components instead of a substring scan per ignored dir.
+        # frozenset() returns a frozenset argument as-is, so callers that convert once pay nothing here.
+        if ignore_dirs and not frozenset(ignore_dirs).isdisjoint(os.path.dirname(file_path).split(os.sep)):
             return False
         
+        # Extension checks are free; do them before paying for a stat
+        file_ext = os.path.splitext(file_path)[1].lower()
         if include_extensions:
-            file_ext = os.path.splitext(file_path)[1].lower()
             if not file_ext or file_ext[1:] not in include_extensions:
                 return False
         
         # Skip binary files by checking for common binary extensions
-        binary_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.pdf', '.zip', '.tar', '.gz', '.exe', '.dll', '.so', '.dylib', '.woff', '.woff2', '.ttf', '.otf'}
-        file_ext = os.path.splitext(file_path)[1].lower()
-        if file_ext in binary_extensions:
+        if file_ext in BINARY_EXTENSIONS:
+            return False
+        
+        # Check file size, statting only when the caller has not already
+        if size is None:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                return False
+        if size > max_file_size:
+            logger.warning(f"Skipping large file {file_path} (size: {size} bytes)")
             return False
         
         return True
     
     def read_file_contents(self, file_path: str) -> str:
-        """Read file contents with encoding fallback."""
-        encodings = ['utf-8', 'latin-1', 'cp1252']
+        """Read file contents with encoding fallback, skipping binary and oversized files."""
+        try:
+            with open(file_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size > MAX_READ_BYTES:
+                    logger.warning(f"Skipping oversized file {file_path}")
+                    return ""
+                head = f.read(BINARY_SNIFF_BYTES)
+                # UTF-16 text is full of NUL bytes, so a BOM has to be honoured before the binary sniff
+                bom_encoding = _bom_encoding(head)
+                # Catches binaries the extension list misses, before the rest of the file is read
+                if bom_encoding is None and (b'\x00' in head or len(head) - len(head.translate(None, _NON_TEXT_BYTES)) > len(head) * BINARY_CONTROL_RATIO):
+                    return ""
+                data = head + f.read()
+        except Exception as e:
+            logger.warning(f"Error reading file {file_path}: {str(e)}")
+            return ""
         
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    return f.read()
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logger.warning(f"Error reading file {file_path}: {str(e)}")
-                return ""
+        # Decode the bytes already in hand; latin-1 maps every byte, so it always succeeds as the fallback
+        try:
+            return data.decode(bom_encoding or 'utf-8')
+        except UnicodeDecodeError:
+            return data.decode('latin-1')
+    
+    def list_git_files(self, repo_path: str) -> Optional[List[tuple]]:
+        """List (relative path, size) for every regular file tracked at HEAD, or None if repo_path is not a git checkout."""
+        if not os.path.isdir(os.path.join(repo_path, '.git')):
+            return None
+        try:
+            output = subprocess.run(
+                ['git', '-C', repo_path, 'ls-tree', '-r', '-z', '--long', 'HEAD'],
+                capture_output=True, check=True
+            ).stdout
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not list files with git, falling back to a directory walk: {e}")
+            return None
         
-        logger.warning(f"Could not decode file {file_path}")
-        return ""
+        files = []
+        for record in output.split(b'\0'):
+            if not record:
+                continue
+            meta, _, path = record.partition(b'\t')
+            mode, object_type, _, size = meta.split()
+            # Submodules (commit entries) and symlinks have nothing to index
+            if object_type != b'blob' or mode == b'120000':
+                continue
+            files.append((os.fsdecode(path), int(size)))
+        return files
     
     def get_repository_files(self, repo_path: str, ignore_dirs: List[str] = None, include_extensions: List[str] = None, max_file_size: int = 100000):
         """Get all files from a repository and convert them to documents."""
+        return list(self.iter_repository_documents(repo_path, ignore_dirs, include_extensions, max_file_size))
+    
+    def iter_repository_documents(self, repo_path: str, ignore_dirs: List[str] = None, include_extensions: List[str] = None, max_file_size: int = 100000):
+        """Yield a document per repository file as soon as it has been read, in walk order."""
         from langchain_core.documents import Document
         
         if ignore_dirs is None:
-            ignore_dirs = ['.git', 'node_modules', '__pycache__', '.idea', '.vscode', 'venv', '.env', 'target', 'build', 'dist']
+            ignore_dirs = DEFAULT_IGNORE_DIRS
         
-        documents = []
+        document_count = 0
         skipped_files = 0
+        ignore_set = frozenset(ignore_dirs)
+        include_ext_set = {f".{ext}" for ext in include_extensions} if include_extensions else None
         
-        for root, _, files in os.walk(repo_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                rel_path = os.path.relpath(file_path, repo_path)
-                
-                if self.should_process_file(file_path, ignore_dirs, include_extensions, max_file_size):
-                    try:
-                        content = self.read_file_contents(file_path)
-                        if content and len(content.strip()) > 0:
-                            doc = Document(
-                                page_content=content,
-                                metadata={
-                                    "source": rel_path,
-                                    "file_name": file,
-                                    "file_path": rel_path,
-                                }
-                            )
-                            documents.append(doc)
-                    except Exception as e:
-                        logger.warning(f"Error processing file {rel_path}: {str(e)}")
+        def candidates():
+            nonlocal skipped_files
+            git_files = self.list_git_files(repo_path)
+            if git_files is not None:
+                # Git already knows every tracked path and blob size: no .git traversal and no per-file stat
+                for rel_path, file_size in git_files:
+                    parts = rel_path.split('/')
+                    file = parts[-1]
+                    file_ext = os.path.splitext(file)[1].lower()
+                    if (not ignore_set.isdisjoint(parts[:-1])
+                            or (include_ext_set is not None and file_ext not in include_ext_set)
+                            or file_ext in BINARY_EXTENSIONS):
                         skipped_files += 1
-                else:
+                    elif file_size > max_file_size:
+                        logger.warning(f"Skipping large file {rel_path} (size: {file_size} bytes)")
+                        skipped_files += 1
+                    else:
+                        yield file, os.path.join(repo_path, rel_path)
+            else:
+                for file_path, file, file_size in self._iter_files(repo_path, ignore_set):
+                    if include_ext_set is not None and os.path.splitext(file)[1].lower() not in include_ext_set:
+                        skipped_files += 1
+                        continue
+                    # Ignored directories and extensions were already filtered above; only type and size remain
+                    if self.should_process_file(file_path, (), None, max_file_size, size=file_size):
+                        yield file, file_path
+                    else:
+                        skipped_files += 1
+        
+        # Reads are I/O bound, so a thread pool overlaps the open/read syscalls of many small files. Reads are
+        # submitted while the walk is still running, with a bounded window in flight to cap open files and memory.
+        with ThreadPoolExecutor(max_workers=FILE_READ_WORKERS) as executor:
+            pending = deque()
+            remaining = candidates()
+            while True:
+                for file, file_path in itertools.islice(remaining, FILE_READ_WORKERS * 2 - len(pending)):
+                    pending.append((file, file_path, executor.submit(self.read_file_contents, file_path)))
+                if not pending:
+                    break
+                file, file_path, future = pending.popleft()
+                content = future.result()
+                rel_path = os.path.relpath(file_path, repo_path)
+                if not content or not content.strip():
+                    continue
+                try:
+                    doc = Document(
+                        page_content=content,
+                        # All values are str so chunks can go to Chroma without a conversion pass
+                        metadata={
+                            "source": rel_path,
+                            "file_name": file,
+                            "file_path": rel_path,
+                            "file_hash": _content_hash(content).hex(),
+                        }
+                    )
+                except Exception as e:
+                    logger.warning(f"Error processing file {rel_path}: {str(e)}")
                     skipped_files += 1
+                    continue
+                document_count += 1
+                yield doc
         
-        logger.info(f"Processed {len(documents)} files from the repository (skipped {skipped_files} files)")
-        return documents
+        logger.info(f"Processed {document_count} files from the repository (skipped {skipped_files} files)")
     
     def split_documents(self, documents, chunk_size: int = 1000, chunk_overlap: int = 100):
         """Split documents into smaller chunks."""
-        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        if len(documents) < PARALLEL_SPLIT_MIN_DOCUMENTS:
+            chunked_docs = _split_document_shard(documents, chunk_size, chunk_overlap)
+        else:
+            # Splitting is pure-Python CPU work; shard it across processes. Contiguous shards keep chunk order,
+            # which matters to callers that truncate to a chunk cap.
+            workers = min(os.cpu_count() or 1, len(documents))
+            shard_size = -(-len(documents) // workers)
+            shards = [documents[i:i + shard_size] for i in range(0, len(documents), shard_size)]
+            chunked_docs = []
+            with _split_process_pool(workers) as executor:
+                for shard_chunks in executor.map(_split_document_shard, shards, [chunk_size] * len(shards), [chunk_overlap] * len(shards)):
+                    chunked_docs.extend(shard_chunks)
         
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", " ", ""]
-        )
+        # Metadata values are already strings (see get_repository_files), as Chroma requires; chunks inherit them
+        return chunked_docs
+    
+    def split_document_stream(self, documents, max_chunk_count: Optional[int] = None, chunk_size: int = 1000, chunk_overlap: int = 100):
+        """Split a generator of documents window by window, returning (chunks, document_count).
         
-        chunked_docs = text_splitter.split_documents(documents)
+        Documents are released as soon as their window is split, so the full document list and the full chunk
+        list are never held together, and the generator is closed once max_chunk_count chunks exist. The
+        result is cut to max_chunk_count on a file boundary.
+        """
+        windows = iter(lambda: list(itertools.islice(documents, PARALLEL_SPLIT_MIN_DOCUMENTS)), [])
         
-        # Ensure all metadata values are strings for Chroma compatibility
-        for doc in chunked_docs:
-            for key in doc.metadata:
-                doc.metadata[key] = str(doc.metadata[key])
+        first = next(windows, None)
+        if first is None:
+            return [], 0
+        second = next(windows, None)
+        if second is None:
+            # Small repository: process start-up would cost more than the split
+            return _cut_at_file_boundary(_split_document_shard(first, chunk_size, chunk_overlap), max_chunk_count), len(first)
         
-        return chunked_docs
+        windows = itertools.chain((first, second), windows)
+        del first, second
+        chunked_docs = []
+        document_count = 0
+        workers = os.cpu_count() or 1
+        with closing(documents), _split_process_pool(workers) as executor:
+            pending = deque()
+            
+            def collect():
+                nonlocal document_count
+                window_size, future = pending.popleft()
+                chunked_docs.extend(future.result())
+                document_count += window_size
+            
+            for window in windows:
+                pending.append((len(window), executor.submit(_split_document_shard, window, chunk_size, chunk_overlap)))
+                del window
+                if len(pending) >= workers * 2:
+                    collect()
+                    if max_chunk_count is not None and len(chunked_docs) >= max_chunk_count:
+                        break
+            while pending and (max_chunk_count is None or len(chunked_docs) < max_chunk_count):
+                collect()
+            for _, future in pending:
+                future.cancel()
+        
+        return _cut_at_file_boundary(chunked_docs, max_chunk_count), document_count
     
     def index_repository(self, repo_url: str, include_extensions: List[str] = None, ignore_dirs: List[str] = None, progress_callback=None, max_file_size: int = 100000, max_chunk_count: int = 5000, force_reindex: bool = False) -> Dict[str, Any]:
         """Index a GitHub repository for RAG queries."""
@@ -200,59 +516,103 @@ class GitHubRAG:
                     progress_callback({"step": "cloning", "progress": 10, "message": f"Cloning repository {repo_name}..."})
                 repo_path = self.clone_github_repo(repo_url, temp_dir)
                 
-                # Get documents
+                # Files whose hash is unchanged since the last run are read but not re-embedded
+                previous_hashes = self._load_file_hashes(collection_name) if collection_name in self.repositories else None
+                current_hashes = {}
+                walk_complete = False
+                
+                def changed_documents():
+                    nonlocal walk_complete
+                    for doc in self.iter_repository_documents(repo_path, ignore_dirs, include_extensions, max_file_size):
+                        file_path, file_hash = doc.metadata["file_path"], doc.metadata["file_hash"]
+                        current_hashes[file_path] = file_hash
+                        previous = previous_hashes.get(file_path) if previous_hashes else None
+                        if previous is None or previous[0] != file_hash:
+                            yield doc
+                    walk_complete = True
+                
+                # Read and split documents in windows; the walk stops early once max_chunk_count is reached
                 if progress_callback:
-                    progress_callback({"step": "scanning", "progress": 25, "message": "Scanning repository files..."})
-                documents = self.get_repository_files(repo_path, ignore_dirs, include_extensions, max_file_size)
+                    progress_callback({"step": "scanning", "progress": 25, "message": "Reading and chunking repository files..."})
+                chunked_docs, document_count = self.split_document_stream(changed_documents(), max_chunk_count)
                 
-                if not documents:
+                if not current_hashes:
                     return {
                         "success": False,
                         "error": "No files found in repository"
                     }
                 
-                # Split documents
                 if progress_callback:
-                    progress_callback({"step": "chunking", "progress": 50, "message": f"Processing {len(documents)} files into chunks..."})
-                chunked_docs = self.split_documents(documents)
-                
-                # Limit chunks to prevent token overflow
-                if len(chunked_docs) > max_chunk_count:
-                    logger.warning(f"Repository has {len(chunked_docs)} chunks, limiting to {max_chunk_count} to prevent token overflow")
-                    chunked_docs = chunked_docs[:max_chunk_count]
+                    progress_callback({"step": "chunking", "progress": 50, "message": f"Split {document_count} new or changed files into {len(chunked_docs)} chunks..."})
                 
                 # Create vector store with batch processing to handle large repositories
                 if progress_callback:
                     progress_callback({"step": "embedding", "progress": 75, "message": f"Generating embeddings for {len(chunked_docs)} chunks..."})
                 
-                # Process in batches to avoid memory issues
-                batch_size = 100
-                vector_store = None
-                for i in range(0, len(chunked_docs), batch_size):
-                    batch = chunked_docs[i:i + batch_size]
-                    
-                    if vector_store is None:
-                        # First batch creates the vector store
-                        vector_store = Chroma.from_documents(
-                            documents=batch,
-                            embedding=self.embeddings,
-                            persist_directory=self.persist_directory,
-                            collection_name=collection_name
+                # One batch per embeddings request: each add is a single API round trip
+                batch_size = EMBEDDING_BATCH_SIZE
+                embeddings = DedupEmbeddings(self.embeddings, [doc.page_content for doc in chunked_docs])
+                vector_store = Chroma(
+                    collection_name=collection_name,
+                    embedding_function=embeddings,
+                    persist_directory=self.persist_directory
+                )
+                
+                indexed_chunks = Counter(doc.metadata["file_path"] for doc in chunked_docs)
+                # Taken from the chunks rather than current_hashes: a file cut short by the chunk cap carries an empty hash
+                indexed_hashes = {doc.metadata["file_path"]: doc.metadata["file_hash"] for doc in chunked_docs}
+                if previous_hashes is None:
+                    file_hashes = {}
+                    if collection_name in self.repositories:
+                        # Indexed before file hashes were recorded: nothing to diff against, so start over
+                        vector_store.delete_collection()
+                        vector_store = Chroma(
+                            collection_name=collection_name,
+                            embedding_function=embeddings,
+                            persist_directory=self.persist_directory
                         )
-                    else:
-                        # Subsequent batches add to existing store
-                        vector_store.add_documents(batch)
-                    
-                    if progress_callback:
-                        progress = 75 + (20 * (i + batch_size) / len(chunked_docs))
-                        progress_callback({"step": "embedding", "progress": min(95, progress), "message": f"Processing batch {i//batch_size + 1}/{(len(chunked_docs) + batch_size - 1)//batch_size}..."})
+                else:
+                    file_hashes = dict(previous_hashes)
+                    # Modified files that made it under the chunk cap are replaced; files left out keep their old
+                    # chunks and hash, so the next run retries them. The cap never cuts through a file (see
+                    # _cut_at_file_boundary). Deletions are only known after a full walk.
+                    stale_paths = [file_path for file_path in indexed_chunks if file_path in file_hashes]
+                    if walk_complete:
+                        stale_paths.extend(file_path for file_path in file_hashes if file_path not in current_hashes)
+                    for i in range(0, len(stale_paths), batch_size):
+                        vector_store.delete(where={"file_path": {"$in": stale_paths[i:i + batch_size]}})
+                    for file_path in stale_paths:
+                        del file_hashes[file_path]
+                    if stale_paths:
+                        logger.info(f"Removed chunks of {len(stale_paths)} changed or deleted files")
+                
+                # Two batches in flight: one can be embedding while the other is being written to the store
+                batch_count = (len(chunked_docs) + batch_size - 1) // batch_size
+                with ThreadPoolExecutor(max_workers=EMBEDDING_PIPELINE_DEPTH) as executor:
+                    futures = [
+                        executor.submit(vector_store.add_documents, chunked_docs[i:i + batch_size])
+                        for i in range(0, len(chunked_docs), batch_size)
+                    ]
+                    for batch_number, future in enumerate(futures, 1):
+                        future.result()
+                        if progress_callback:
+                            progress = 75 + (20 * batch_number / batch_count)
+                            progress_callback({"step": "embedding", "progress": min(95, progress), "message": f"Processing batch {batch_number}/{batch_count}..."})
+                
+                if embeddings.reused:
+                    logger.info(f"Reused embeddings for {embeddings.reused} duplicate chunks")
+                
+                for file_path, chunk_count in indexed_chunks.items():
+                    file_hashes[file_path] = [indexed_hashes[file_path], chunk_count]
+                self._save_file_hashes(collection_name, file_hashes)
                 
                 # Update repository index
+                self._forget_collection(collection_name)
                 self.repositories[collection_name] = {
                     "repo_url": repo_url,
                     "repo_name": repo_name,
-                    "document_count": len(documents),
-                    "chunk_count": len(chunked_docs),
+                    "document_count": len(file_hashes),
+                    "chunk_count": sum(chunk_count for _, chunk_count in file_hashes.values()),
                     "indexed_at": datetime.now().isoformat()
                 }
                 
@@ -266,8 +626,10 @@ class GitHubRAG:
                     "message": f"Successfully indexed repository {repo_name}",
                     "collection_name": collection_name,
                     "repo_name": repo_name,
-                    "document_count": len(documents),
-                    "chunk_count": len(chunked_docs)
+                    "document_count": document_count,
+                    "chunk_count": len(chunked_docs),
+                    "total_document_count": self.repositories[collection_name]["document_count"],
+                    "total_chunk_count": self.repositories[collection_name]["chunk_count"]
                 }
                 
         except Exception as e:
@@ -277,13 +639,55 @@ class GitHubRAG:
                 "error": str(e)
             }
     
+    def _get_vector_store(self, collection_name: str):
+        """Open a collection's vector store once and reuse it across queries, keeping the most recently used few."""
+        vector_store = self._stores.get(collection_name)
+        if vector_store is not None:
+            self._stores.move_to_end(collection_name)
+            return vector_store
+        
+        from langchain_chroma import Chroma
+        vector_store = Chroma(
+            persist_directory=self.persist_directory,
+            embedding_function=self.embeddings,
+            collection_name=collection_name
+        )
+        self._stores[collection_name] = vector_store
+        if len(self._stores) > MAX_OPEN_STORES:
+            # Retrievers hold a reference to their store, so they go with it
+            self._forget_collection(next(iter(self._stores)))
+        return vector_store
+    
+    def _get_retriever(self, collection_name: str, max_results: int):
+        """Build a collection's retriever once per result count."""
+        # Opening (or touching) the store first keeps its LRU position current
+        vector_store = self._get_vector_store(collection_name)
+        key = (collection_name, max_results)
+        retriever = self._retrievers.get(key)
+        if retriever is None:
+            retriever = vector_store.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": max_results}
+            )
+            self._retrievers[key] = retriever
+        return retriever
+    
+    def _get_answer_chain(self):
+        """Prompt -> LLM -> text; takes the retrieved context as input so retrieval runs only once per query."""
+        if self._answer_chain is None:
+            from langchain_core.prompts import ChatPromptTemplate
+            from langchain_core.output_parsers import StrOutputParser
+            self._answer_chain = ChatPromptTemplate.from_template(RAG_PROMPT_TEMPLATE) | self.llm | StrOutputParser()
+        return self._answer_chain
+    
+    def _forget_collection(self, collection_name: str):
+        """Drop cached stores and retrievers so a re-indexed collection is reopened."""
+        self._stores.pop(collection_name, None)
+        for key in [key for key in self._retrievers if key[0] == collection_name]:
+            del self._retrievers[key]
+    
     def query_repository(self, collection_name: str, question: str, max_results: int = 5) -> Dict[str, Any]:
         """Query an indexed repository."""
-        from langchain_chroma import Chroma
-        from langchain_core.prompts import ChatPromptTemplate
-        from langchain_core.runnables import RunnablePassthrough
-        from langchain_core.output_parsers import StrOutputParser
-        
         if collection_name not in self.repositories:
             return {
                 "success": False,
@@ -291,59 +695,14 @@ class GitHubRAG:
             }
         
         try:
-            # Load vector store
-            vector_store = Chroma(
-                persist_directory=self.persist_directory,
-                embedding_function=self.embeddings,
-                collection_name=collection_name
-            )
-            
-            # Set up retriever
-            retriever = vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": max_results}
-            )
-            
-            # Get relevant documents
-            relevant_docs = retriever.get_relevant_documents(question)
-            
-            # Create prompt with citations
-            prompt_template = """You are an expert code analyst. Use the following code snippets from the repository to answer the question.
-            Provide a comprehensive answer and include specific citations with file paths and relevant code snippets.
-
-Question: {question}
-
-Code Context:
-{context}
-
-Instructions:
-1. Answer the question based on the provided code context
-2. Include specific file references in your answer
-3. Quote relevant code snippets when helpful
-4. If the answer isn't in the provided context, say so clearly
-
-Answer:"""
-
-            prompt = ChatPromptTemplate.from_template(prompt_template)
-            
-            def format_docs_with_citations(docs):
-                formatted = []
-                for i, doc in enumerate(docs, 1):
-                    file_path = doc.metadata.get('file_path', 'unknown')
-                    content = doc.page_content
-                    formatted.append(f"[Source {i}: {file_path}]\n{content}")
-                return "\n\n".join(formatted)
-            
-            # Create RAG chain
-            rag_chain = (
-                {"context": retriever | format_docs_with_citations, "question": RunnablePassthrough()}
-                | prompt
-                | self.llm
-                | StrOutputParser()
-            )
+            # Retrieve once; the same documents feed both the LLM context and the citations
+            relevant_docs = self._get_retriever(collection_name, max_results).invoke(question)
             
             # Get answer
-            answer = rag_chain.invoke(question)
+            answer = self._get_answer_chain().invoke({
+                "context": format_docs_with_citations(relevant_docs),
+                "question": question
+            })
             
             # Prepare citations
             citations = []
@@ -400,7 +759,7 @@ Answer:"""
     def get_repository_stats(self, repo_path: str, ignore_dirs: List[str] = None) -> Dict[str, Any]:
         """Get statistics about a repository to help with filtering decisions."""
         if ignore_dirs is None:
-            ignore_dirs = ['.git', 'node_modules', '__pycache__', '.idea', '.vscode', 'venv', '.env', 'target', 'build', 'dist']
+            ignore_dirs = DEFAULT_IGNORE_DIRS
         
         stats = {
             'total_files': 0,
@@ -410,25 +769,16 @@ Answer:"""
             'total_size': 0
         }
         
-        for root, dirs, files in os.walk(repo_path):
-            # Skip ignored directories
-            dirs[:] = [d for d in dirs if not any(ignore in root for ignore in ignore_dirs)]
+        # Ignored directories are pruned by name, so e.g. files directly inside .git are no longer counted
+        for file_path, file, file_size in self._iter_files(repo_path, ignore_dirs):
+            stats['total_files'] += 1
+            stats['total_size'] += file_size
             
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    file_size = os.path.getsize(file_path)
-                    stats['total_files'] += 1
-                    stats['total_size'] += file_size
-                    
-                    if file_size > 100000:  # Files larger than 100KB
-                        stats['large_files'] += 1
-                    
-                    ext = os.path.splitext(file)[1].lower()
-                    if ext:
-                        stats['file_extensions'][ext] = stats['file_extensions'].get(ext, 0) + 1
-                    
-                except OSError:
-                    continue
+            if file_size > 100000:  # Files larger than 100KB
+                stats['large_files'] += 1
+            
+            ext = os.path.splitext(file)[1].lower()
+            if ext:
+                stats['file_extensions'][ext] = stats['file_extensions'].get(ext, 0) + 1
         
         return stats
\ No newline at end of file
@@ -4,6 +4,65 @@ import uuid
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 import os
+import re
+import time
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+# One tag filter; tags are stored as a JSON array, so json_each lets SQLite test membership directly
+_TAG_CONDITION = "EXISTS (SELECT 1 FROM json_each(memories.tags) WHERE json_each.value = ?)"
+
+# Words too common to say anything about which memory a message is about
+_STOP_WORDS = frozenset("""
+a about after all also am an and any are as at be been but by can could did do does for from had has have
+he her him his how i if in into is it its just me my no not now of on or our out she so some than that the
+their them then there these they this to too up us was we were what when where which who why will with
+would you your
+""".split())
+
+class ContextCache:
+    """LRU cache with a TTL for memory context strings, keyed by SHA-256 of the query.
+    
+    Safe to share between threads: the web server looks up context from several at once.
+    """
+    
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(*parts: Any) -> str:
+        return hashlib.sha256("\x00".join(str(part) for part in parts).encode()).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def put(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every MemoryManager so repeated context lookups are answered without querying the database
+_context_cache = ContextCache()
 
 class MemoryManager:
     """Manages persistent memory storage for the agent using SQLite."""
@@ -49,8 +108,63 @@ class MemoryManager:
                 CREATE INDEX IF NOT EXISTS idx_memories_created_at ON memories(created_at)
             """)
             
+            self.fts_enabled = self._init_fts(cursor)
             conn.commit()
     
+    def _init_fts(self, cursor) -> bool:
+        """Create the FTS5 index over title/content, kept in sync by triggers. Returns False if FTS5 is unavailable."""
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'memories_fts'")
+        row = cursor.fetchone()
+        if row is not None and "content_rowid" in row[0]:
+            # Earlier versions indexed by the implicit rowid, which VACUUM may renumber on a table with a
+            # TEXT primary key; replace that index with one keyed by id
+            for name in ("memories_fts_insert", "memories_fts_delete", "memories_fts_update"):
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute("DROP TABLE memories_fts")
+            row = None
+        try:
+            # A standalone table holding its own copy of the text, keyed by the memory id
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts
+                USING fts5(id UNINDEXED, title, content)
+            """)
+        except sqlite3.OperationalError:
+            return False
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN
+                INSERT INTO memories_fts(id, title, content) VALUES (new.id, new.title, new.content);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_delete AFTER DELETE ON memories BEGIN
+                DELETE FROM memories_fts WHERE id = old.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS memories_fts_update AFTER UPDATE OF title, content ON memories BEGIN
+                UPDATE memories_fts SET title = new.title, content = new.content WHERE id = old.id;
+            END
+        """)
+        if row is None:
+            # Index memories saved before the FTS table existed
+            cursor.execute("INSERT INTO memories_fts(id, title, content) SELECT id, title, content FROM memories")
+        return True
+    
+    @staticmethod
+    def _fts_query(query: str) -> Optional[str]:
+        """Turn free text into an FTS5 query matching any of its significant words, or None if it has none.
+        
+        Stop words and single characters are dropped: nearly every memory contains them, so they would
+        make every memory match.
+        """
+        words = []
+        for word in re.findall(r"\w+", query.lower()):
+            if len(word) > 1 and word not in _STOP_WORDS and word not in words:
+                words.append(word)
+        if not words:
+            return None
+        return " OR ".join(f'"{word}"' for word in words[:32])
+    
     def save_memory(self, title: str, content: str, tags: List[str] = None, metadata: Dict[str, Any] = None) -> str:
         """Save a new memory and return its ID."""
         memory_id = str(uuid.uuid4())
@@ -65,6 +179,7 @@ class MemoryManager:
             """, (memory_id, title, content, tags_str, metadata_str))
             conn.commit()
         
+        _context_cache.clear()
         return memory_id
     
     def get_memory(self, memory_id: str) -> Optional[Dict[str, Any]]:
@@ -97,14 +212,26 @@ class MemoryManager:
         return None
     
     def search_memories(self, query: str = None, tags: List[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
-        """Search memories by content, title, or tags."""
+        """Search memories by content, title, or tags.
+        
+        With FTS5 available, a query matches memories containing any of its words, best matches first;
+        otherwise it falls back to a substring match.
+        """
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             
             where_conditions = []
             params = []
+            from_clause = "memories"
+            order_by = "accessed_at DESC, created_at DESC"
+            fts_query = self._fts_query(query) if query and self.fts_enabled else None
             
-            if query:
+            if fts_query:
+                from_clause = "memories JOIN memories_fts ON memories_fts.id = memories.id"
+                where_conditions.append("memories_fts MATCH ?")
+                params.append(fts_query)
+                order_by = "memories_fts.rank, " + order_by
+            elif query:
                 # Validate query length and complexity
                 MAX_QUERY_LENGTH = 10000
                 if len(query) > MAX_QUERY_LENGTH:
@@ -121,16 +248,17 @@ class MemoryManager:
                 for tag in tags:
                     if len(tag) > 500:
                         raise ValueError(f"Tag search too long ({len(tag)} characters). Maximum allowed: 500 characters.")
-                    where_conditions.append("tags LIKE ?")
-                    params.append(f"%{tag}%")
+                    # Match whole tags inside the JSON array rather than substrings of it
+                    where_conditions.append(_TAG_CONDITION)
+                    params.append(tag)
             
             where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
             
             sql = f"""
-                SELECT id, title, content, tags, metadata, created_at, updated_at, accessed_at
-                FROM memories 
+                SELECT memories.id, memories.title, memories.content, tags, metadata, created_at, updated_at, accessed_at
+                FROM {from_clause}
                 WHERE {where_clause}
-                ORDER BY accessed_at DESC, created_at DESC
+                ORDER BY {order_by}
                 LIMIT ?
             """
             params.append(limit)
@@ -173,7 +301,7 @@ class MemoryManager:
             
             if tags:
                 for tag in tags:
-                    where_conditions.append("tags = ?")
+                    where_conditions.append(_TAG_CONDITION)
                     params.append(tag)
             
             where_clause = " AND ".join(where_conditions) if where_conditions else "1=1"
@@ -275,6 +403,7 @@ class MemoryManager:
             
             success = cursor.rowcount > 0
             conn.commit()
+            _context_cache.clear()
             return success
     
     def delete_memory(self, memory_id: str) -> bool:
@@ -284,6 +413,7 @@ class MemoryManager:
             cursor.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
             success = cursor.rowcount > 0
             conn.commit()
+            _context_cache.clear()
             return success
     
     def list_memories(self, limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
@@ -314,7 +444,22 @@ class MemoryManager:
             return results
     
     def get_memory_context(self, query: str = None, max_memories: int = 5) -> str:
-        """Get relevant memories as context string for the agent."""
+        """Get relevant memories as context string for the agent. Results are cached until a memory changes."""
+        # The file's mtime and size are part of the key, so writes from another process (e.g. the CLI while
+        # the web app runs) invalidate entries too, not just writes through this process's managers
+        try:
+            db_stat = os.stat(self.db_path)
+            db_version = (db_stat.st_mtime_ns, db_stat.st_size)
+        except OSError:
+            db_version = None
+        cache_key = ContextCache.key(os.path.abspath(self.db_path), db_version, max_memories, query)
+        context = _context_cache.get(cache_key)
+        if context is None:
+            context = self._build_memory_context(query, max_memories)
+            _context_cache.put(cache_key, context)
+        return context
+    
+    def _build_memory_context(self, query: str, max_memories: int) -> str:
         memories = self.search_memories(query=query, limit=max_memories)
         
         if not memories:
@@ -328,4 +473,14 @@ class MemoryManager:
             context_parts.append(f"Content: {memory['content']}")
             context_parts.append("---")
         
-        return "\n".join(context_parts)
\ No newline at end of file
+        return "\n".join(context_parts)
+
+
+@functools.lru_cache(maxsize=None)
+def _shared_memory_manager(db_path: str) -> MemoryManager:
+    return MemoryManager(db_path)
+
+
+def get_shared_memory_manager(db_path: str = "meta/memory.db") -> MemoryManager:
+    """Return one MemoryManager per database file instead of re-running schema setup on every call."""
+    return _shared_memory_manager(os.path.abspath(db_path))
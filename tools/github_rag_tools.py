@@ -28,8 +28,8 @@ def get_current_memory_manager():
         return get_memory_manager()
     except ImportError:
         # Fallback when not in Flask context
-        from memory import MemoryManager
-        return MemoryManager()
+        from memory import get_shared_memory_manager
+        return get_shared_memory_manager()
 
 github_rag_index_tool = {
     "name": "github_rag_index",
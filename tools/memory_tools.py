@@ -2,17 +2,17 @@ def get_current_memory_manager():
     """Get the memory manager for the current session."""
     try:
         from flask import session as flask_session
-        from memory import MemoryManager
+        from memory import get_shared_memory_manager
         session_id = flask_session.get('session_id')
         # This will need to be imported from the main module
         from agent import sessions
         if session_id and session_id in sessions:
             return sessions[session_id]['memory_manager']
-        return MemoryManager()  # Fallback to default
+        return get_shared_memory_manager()  # Fallback to default
     except ImportError:
         # Fallback when not in Flask context
-        from memory import MemoryManager
-        return MemoryManager()
+        from memory import get_shared_memory_manager
+        return get_shared_memory_manager()
 
 def get_search_optimizer():
     """Get the search query optimizer."""